@@ -1,7 +1,11 @@
 from datasets import load_dataset
 import os
+import sys
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from keyword_matcher import KeywordMatcher
+
 # Create directory
 output_dir = "datasets/washing_machine_corpus"
 if not os.path.exists(output_dir):
@@ -11,10 +15,12 @@ print("Loading WikiText-2...")
 dataset = load_dataset("wikitext", "wikitext-2-raw-v1")
 
 keywords = ["washing machine", "washing", "machine"]
+# Substring tests for a few keywords, one automaton pass per document for a sweep-sized list
+matcher = KeywordMatcher(keywords)
 
 def filter_function(example):
     text = example['text'].lower()
-    return any(k in text for k in keywords)
+    return matcher.contains_any(text)
 
 print("Filtering dataset...")
 filtered_dataset = dataset.filter(filter_function)
@@ -0,0 +1,88 @@
+from transformer_lens import HookedTransformer
+from datasets import load_from_disk
+import matplotlib.pyplot as plt
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from token_cache import cached_tokenize
+from token_index import cached_token_index, compound_targets
+from attention_flow import extract_attention_flow
+
+# Configuration
+DEVICE = "cpu"
+MODEL_NAME = "gpt2-small"
+DATASET_PATH = "datasets/washing_machine_corpus"
+RESULTS_DIR = "results"
+BATCH_SIZE = 32
+
+os.makedirs(os.path.join(RESULTS_DIR, "figures"), exist_ok=True)
+
+print(f"Loading model {MODEL_NAME}...")
+model = HookedTransformer.from_pretrained(MODEL_NAME, device=DEVICE)
+model.eval()
+
+print(f"Loading dataset from {DATASET_PATH}...")
+dataset = load_from_disk(DATASET_PATH)
+texts = [example['text'] for example in dataset['train']]
+token_seqs = cached_tokenize(model, texts)
+token_index = cached_token_index(model, texts, lambda: token_seqs)
+
+token_washing = model.to_single_token(" washing")
+token_machine = model.to_single_token(" machine")
+category_targets = compound_targets(token_index, [token_washing], [token_machine])
+
+# Queries at " machine"; the key is the token right before it (" washing" in the compound)
+directions = {
+    "washing": model.W_E[token_washing].detach().cpu().numpy(),
+    "machine": model.W_E[token_machine].detach().cpu().numpy(),
+}
+results = {"layers": list(range(model.cfg.n_layers)), "directions": list(directions.keys()), "categories": {}}
+for cat in ["compound_head", "other_head"]:
+    targets = [(doc, pos) for doc, pos in category_targets[cat] if pos > 0]
+    if not targets:
+        continue
+    print(f"Extracting attention flow for {len(targets)} {cat} positions...")
+    flow = extract_attention_flow(
+        model, token_seqs, targets, key_positions=[pos - 1 for _, pos in targets], directions=directions,
+        batch_size=BATCH_SIZE,
+    )
+    results["categories"][cat] = {
+        "count": len(targets),
+        # [layers, heads]: mean attention from " machine" to the previous token
+        "attention_to_previous": flow["pattern"].mean(axis=0).tolist(),
+        "head_norm": flow["head_norm"].mean(axis=0).tolist(),
+        # [layers, heads, directions]: mean projection of each head's output
+        "projection": flow["projection"].mean(axis=0).tolist(),
+    }
+
+with open(os.path.join(RESULTS_DIR, "attention_flow.json"), "w") as f:
+    json.dump(results, f, indent=2)
+
+if len(results["categories"]) == 2:
+    compound = results["categories"]["compound_head"]
+    other = results["categories"]["other_head"]
+    # Heads that attend to " washing" more than to an arbitrary previous token, and
+    # whose output at " machine" moves toward the " washing" embedding
+    attention_diff = np.array(compound["attention_to_previous"]) - np.array(other["attention_to_previous"])
+    washing = results["directions"].index("washing")
+    projection_diff = np.array(compound["projection"])[..., washing] - np.array(other["projection"])[..., washing]
+
+    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+    for ax, values, title in [
+        (axes[0], attention_diff, "Attention to previous token (compound - other)"),
+        (axes[1], projection_diff, "Head output on ' washing' direction (compound - other)"),
+    ]:
+        limit = np.abs(values).max() or 1.0
+        im = ax.imshow(values, aspect="auto", cmap="RdBu", vmin=-limit, vmax=limit, origin="lower")
+        ax.set_xlabel("Head")
+        ax.set_ylabel("Layer")
+        ax.set_title(title)
+        fig.colorbar(im, ax=ax)
+    plt.tight_layout()
+    plt.savefig(os.path.join(RESULTS_DIR, "figures", "attention_flow.png"))
+
+print("Attention flow complete. Results saved.")
@@ -0,0 +1,55 @@
+from transformer_lens import HookedTransformer
+from datasets import load_from_disk
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from token_cache import cached_tokenize
+from compound_sweep import run_sweep, load_compounds
+from token_index import cached_token_index
+
+# Configuration
+DEVICE = "cpu"
+MODEL_NAME = "gpt2-small"
+DATASET_PATH = "datasets/washing_machine_corpus"
+RESULTS_DIR = "results"
+BATCH_SIZE = 32
+
+if not os.path.exists(RESULTS_DIR):
+    os.makedirs(RESULTS_DIR)
+
+compounds = load_compounds()
+print(f"Sweeping {len(compounds)} compounds")
+
+print(f"Loading model {MODEL_NAME}...")
+model = HookedTransformer.from_pretrained(MODEL_NAME, device=DEVICE)
+model.eval()
+
+print(f"Loading dataset from {DATASET_PATH}...")
+dataset = load_from_disk(DATASET_PATH)
+
+print("Tokenizing corpus...")
+texts = [example['text'] for example in dataset['train']]
+token_seqs = cached_tokenize(model, texts, prepend_bos=True)
+
+# Built once per (tokenizer, corpus); each compound is then a postings lookup
+token_index = cached_token_index(model, texts, lambda: token_seqs)
+
+print("Processing examples...")
+rows = run_sweep(
+    model, token_seqs, compounds, hook_name="blocks.11.hook_resid_post", batch_size=BATCH_SIZE,
+    token_index=token_index,
+)
+
+for row in rows:
+    counts = row["counts"]
+    sim = row["metrics"]["sim_compound_vs_other_head"]
+    sim_str = f"{sim:.4f}" if sim is not None else "n/a"
+    print(f"  {row['compound']!r}: compound={counts['compound_head']} other_head={counts['other_head']} "
+          f"modifier={counts['modifier']} sim={sim_str}")
+
+with open(os.path.join(RESULTS_DIR, "compound_sweep_results.json"), "w") as f:
+    json.dump(rows, f, indent=2)
+
+print("Sweep complete. Results saved.")
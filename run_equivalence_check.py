@@ -0,0 +1,28 @@
+from transformer_lens import HookedTransformer
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from activation_extractor import check_batched_equivalence
+
+# Configuration
+DEVICE = "cpu"
+MODEL_NAME = "gpt2-small"
+BATCH_SIZE = 2
+HOOK_NAMES = ["blocks.0.hook_resid_post", "blocks.5.hook_resid_post", "blocks.11.hook_resid_post"]
+# Different lengths, so every batch is right-padded
+PROMPTS = [
+    "The washing machine is broken.",
+    "She put the clothes in the washing machine and went out for a walk.",
+    "A sewing machine",
+    "I bought a new machine for washing dishes, but it never worked properly after the move.",
+    "Washing",
+]
+
+print(f"Loading model {MODEL_NAME}...")
+model = HookedTransformer.from_pretrained(MODEL_NAME, device=DEVICE)
+model.eval()
+
+print(f"Comparing batched extraction with per-example run_with_cache on {len(PROMPTS)} prompts...")
+max_diff = check_batched_equivalence(model, PROMPTS, HOOK_NAMES, batch_size=BATCH_SIZE)
+print(f"Batched activations match run_with_cache (max abs diff {max_diff:.2e}).")
@@ -2,175 +2,228 @@ import torch
 from transformer_lens import HookedTransformer
 from datasets import load_from_disk
 import numpy as np
-from tqdm import tqdm
 import json
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from activation_extractor import extract_indexed_activations, activations_by_category
+from token_patterns import compound_masks
+from activation_store import dataset_fingerprint, cached_activations
+from sharded_extraction import sharded_category_stats
+from accumulators import RunningStats, stats_by_category, centered_cosine, mean_regression
+from corpus_stream import stream_category_stats
+from token_index import cached_token_index, compound_targets
+from token_cache import cached_tokenize
+from bootstrap import bootstrap_compound_metrics
 
 # Configuration
 DEVICE = "cpu" # "cuda" if available, but cpu is fine for inference on small model
 MODEL_NAME = "gpt2-small"
 DATASET_PATH = "datasets/washing_machine_corpus"
 RESULTS_DIR = "results"
-
-if not os.path.exists(RESULTS_DIR):
-    os.makedirs(RESULTS_DIR)
-
-print(f"Loading model {MODEL_NAME}...")
-model = HookedTransformer.from_pretrained(MODEL_NAME, device=DEVICE)
-model.eval()
-
-print(f"Loading dataset from {DATASET_PATH}...")
-dataset = load_from_disk(DATASET_PATH)
-
-# Token IDs
-# We need to be careful with spacing. 
-# " washing machine" -> " washing" (space) + " machine" (space)
-# "washing machine" -> "washing" (no space) + " machine" (space)
-# Most usually in text: " washing machine" (middle of sentence)
-
-# Let's find the IDs for " machine" and " washing"
-# Note: GPT-2 tokens usually include the leading space.
-token_machine = model.to_single_token(" machine")
-token_washing = model.to_single_token(" washing")
-
-print(f"Target Token ' machine': {token_machine}")
-print(f"Target Token ' washing': {token_washing}")
-
-activations_washing_machine = [] # ' machine' when preceded by ' washing'
-activations_other_machine = []   # ' machine' when NOT preceded by ' washing'
-activations_washing = []         # ' washing' tokens
-
-# Iterate and extract
-print("Processing examples...")
-for example in tqdm(dataset['train']):
-    text = example['text']
-    try:
-        # Prepend space to ensure consistent tokenization if start of string?
-        # Actually, let's just use the text as is, but handle tokenization carefully.
-        tokens = model.to_tokens(text, prepend_bos=True)[0] # Shape [seq_len]
-        
-        # Convert to list for easier indexing
-        tokens_list = tokens.tolist()
-        
-        # Find occurrences
-        for i in range(len(tokens_list)):
-            token = tokens_list[i]
-            
-            # Case 1: Found " washing"
-            if token == token_washing:
-                # Get residual stream at this position
-                # We need to run the model. Efficient way: run batch? 
-                # For simplicity/speed in this script, let's run one by one or minimal caching.
-                # To get activations efficiently, we can run model on the whole sequence 
-                # and pick indices.
-                pass 
-                
-            # We'll do a second pass or structure this better to avoid re-running model multiple times per line.
-            
-    except Exception as e:
-        print(f"Error processing text: {e}")
-        continue
-
-# Better approach: 
-# 1. Collect all valid indices for each category.
-# 2. Run model once per example, extract relevant vectors.
-
-count_wm = 0
-count_m = 0
-count_w = 0
-
-with torch.no_grad():
-    for example in tqdm(dataset['train']):
-        text = example['text']
-        tokens = model.to_tokens(text, prepend_bos=True)[0]
-        tokens_list = tokens.tolist()
-        
-        # Check if we have anything interesting
-        has_machine = token_machine in tokens_list
-        has_washing = token_washing in tokens_list
-        
-        if not (has_machine or has_washing):
-            continue
-            
-        # Run model to get cache
-        # We want the residual stream at the end of the model (before LN_f) or output of last layer?
-        # Usually "resid_post" of the last layer.
-        _, cache = model.run_with_cache(tokens, names_filter=lambda n: n.endswith("resid_post"))
-        
-        # Get the tensor for the last layer's residual stream
-        # Shape: [batch=1, seq_len, d_model]
-        resid = cache["blocks.11.hook_resid_post"][0] 
-        
-        for i, token in enumerate(tokens_list):
-            
-            # Collect ' washing' vectors
-            if token == token_washing:
-                vec = resid[i].cpu().numpy()
-                activations_washing.append(vec)
-                count_w += 1
-                
-            # Collect ' machine' vectors
-            if token == token_machine:
-                # Check previous token
-                if i > 0 and tokens_list[i-1] == token_washing:
-                    # It is " washing machine"
-                    vec = resid[i].cpu().numpy()
-                    activations_washing_machine.append(vec)
-                    count_wm += 1
-                else:
-                    # It is " machine" but NOT " washing machine"
-                    # Note: could be "sewing machine", "time machine", etc.
-                    vec = resid[i].cpu().numpy()
-                    activations_other_machine.append(vec)
-                    count_m += 1
-
-print(f"Collected counts:")
-print(f"  ' washing': {count_w}")
-print(f"  ' washing machine': {count_wm}")
-print(f"  ' machine' (other): {count_m}")
-
-# Analysis
-if count_wm < 5 or count_m < 5 or count_w < 5:
-    print("WARNING: Not enough data for robust analysis.")
-
-# Compute means
-mean_w = np.mean(activations_washing, axis=0) if activations_washing else np.zeros(768)
-mean_wm = np.mean(activations_washing_machine, axis=0) if activations_washing_machine else np.zeros(768)
-mean_m_other = np.mean(activations_other_machine, axis=0) if activations_other_machine else np.zeros(768)
+BATCH_SIZE = 32
+# We want the residual stream at the end of the model: "resid_post" of the last layer.
+HOOK_NAME = "blocks.11.hook_resid_post"
+# >1: split the corpus into shards and extract in a process pool (one model per worker).
+# Only per-category running stats come back, so the activation store is not used.
+N_WORKERS = 1
+# Local .txt / .jsonl / .arrow corpus (file or directory) to stream instead of DATASET_PATH.
+# Documents are keyword-prefiltered, tokenized and extracted chunk by chunk.
+STREAM_CORPUS_PATH = None
+STREAM_KEYWORDS = ["washing", "machine"]
+# Tokens of left context per occurrence (None = whole documents, truncated to n_ctx).
+# With a window, paragraphs are not truncated and only a window ending at each target is
+# run; see run_window_sweep.py for how small it can be before the metrics move.
+CONTEXT_WINDOW = None
+# Bootstrap replicates for confidence intervals on the metrics (0 = point estimates only).
+# Needs per-occurrence vectors, so only the single-process path reports them, and the
+# resampled groups are loaded into RAM: opt in only when they fit.
+BOOTSTRAP_REPLICATES = 0
 
 # 1. Cosine Similarity between "washing machine" (whole) and "machine" (other)
 def cosine_sim(a, b):
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
-sim_wm_m = cosine_sim(mean_wm, mean_m_other)
-print(f"Cosine Sim (Washing Machine vs Other Machine): {sim_wm_m:.4f}")
-
-# 2. Vector Difference: What does "washing" add to "machine"?
-diff_vector = mean_wm - mean_m_other
-
-# 3. Does this difference align with the "washing" vector?
-sim_diff_w = cosine_sim(diff_vector, mean_w)
-print(f"Cosine Sim ((WM - M) vs Washing): {sim_diff_w:.4f}")
-
-# 4. Check linearity: wm approx m + w?
-# composition = mean_m_other + mean_w
-# sim_composition = cosine_sim(mean_wm, composition)
-# print(f"Cosine Sim (WM vs (M + W)): {sim_composition:.4f}")
-
-# Save results
-results = {
-    "counts": {
-        "washing": count_w,
-        "washing_machine": count_wm,
-        "other_machine": count_m
-    },
-    "metrics": {
-        "sim_wm_vs_m_other": float(sim_wm_m),
-        "sim_diff_vs_washing": float(sim_diff_w)
+def extract_category_stats(model, texts, token_washing, token_machine):
+    """
+    Single process: tokenize the whole corpus once (cached on disk), then run one
+    forward pass per length-bucketed batch.
+    Returns (dict category -> RunningStats, bootstrap intervals or None).
+    """
+    truncate = CONTEXT_WINDOW is None
+    token_seqs = cached_tokenize(model, texts, prepend_bos=True, truncate=truncate)
+    # Occurrences come from the persisted token index: only documents containing
+    # ' washing' or ' machine' are ever run through the model
+    token_index = cached_token_index(model, texts, lambda: token_seqs, truncate=truncate)
+
+    # Activations are stored on disk keyed by (model, hook, dataset), so re-running
+    # with different metrics is a memory-mapped load instead of a re-extraction.
+    selection = f"compound_masks: washing={token_washing} machine={token_machine}"
+    if CONTEXT_WINDOW is not None:
+        selection += f" window={CONTEXT_WINDOW}"
+    fingerprint = dataset_fingerprint(texts, selection)
+    # Rows are streamed batch by batch into the store's memmap, never held in RAM
+    vectors, index = cached_activations(
+        lambda out_dir: extract_indexed_activations(
+            model,
+            token_seqs,
+            hook_names=[HOOK_NAME],
+            batch_size=BATCH_SIZE,
+            category_targets=compound_targets(token_index, [token_washing], [token_machine]),
+            context_window=CONTEXT_WINDOW,
+            out_dir=out_dir,
+        ),
+        MODEL_NAME,
+        [HOOK_NAME],
+        fingerprint,
+        stream=True,
+    )
+    # Streamed out of the memory-mapped store in chunks; the stats never hold the raw vectors
+    category_stats = stats_by_category(vectors, index)
+
+    intervals = None
+    counts = {cat: stats.count for cat, stats in category_stats.items()}
+    if BOOTSTRAP_REPLICATES and all(counts.get(cat) for cat in ("compound_head", "modifier", "other_head")):
+        # Opt-in: copies every vector of the resampled groups out of the store
+        activations = activations_by_category(vectors, index)
+        intervals = bootstrap_compound_metrics(
+            activations["compound_head"], activations["modifier"], activations["other_head"],
+            n_boot=BOOTSTRAP_REPLICATES,
+        )
+    return category_stats, intervals
+
+def sharded_category_stats_for(texts, token_washing, token_machine):
+    """Process pool over corpus shards; merges per-category RunningStats."""
+    return sharded_category_stats(
+        MODEL_NAME, texts, [token_washing], [token_machine],
+        hook_name=HOOK_NAME, n_workers=N_WORKERS, batch_size=BATCH_SIZE,
+    )
+
+def main():
+    if not os.path.exists(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+
+    print(f"Loading model {MODEL_NAME}...")
+    model = HookedTransformer.from_pretrained(MODEL_NAME, device=DEVICE)
+    model.eval()
+
+    # Token IDs
+    # We need to be careful with spacing.
+    # " washing machine" -> " washing" (space) + " machine" (space)
+    # "washing machine" -> "washing" (no space) + " machine" (space)
+    # Most usually in text: " washing machine" (middle of sentence)
+
+    # Let's find the IDs for " machine" and " washing"
+    # Note: GPT-2 tokens usually include the leading space.
+    token_machine = model.to_single_token(" machine")
+    token_washing = model.to_single_token(" washing")
+
+    print(f"Target Token ' machine': {token_machine}")
+    print(f"Target Token ' washing': {token_washing}")
+
+    print("Processing examples...")
+    intervals = None
+    if STREAM_CORPUS_PATH is not None:
+        print(f"Streaming corpus from {STREAM_CORPUS_PATH}...")
+        category_stats, n_documents = stream_category_stats(
+            model,
+            STREAM_CORPUS_PATH,
+            lambda tokens, mask: compound_masks(tokens, [token_washing], [token_machine], mask),
+            keywords=STREAM_KEYWORDS,
+            hook_name=HOOK_NAME,
+            batch_size=BATCH_SIZE,
+        )
+        print(f"Streamed {n_documents} matching documents")
+    else:
+        print(f"Loading dataset from {DATASET_PATH}...")
+        dataset = load_from_disk(DATASET_PATH)
+        texts = [example['text'] for example in dataset['train']]
+
+        if N_WORKERS > 1:
+            print(f"Sharded extraction with {N_WORKERS} workers")
+            category_stats = sharded_category_stats_for(texts, token_washing, token_machine)
+        else:
+            category_stats, intervals = extract_category_stats(model, texts, token_washing, token_machine)
+
+    report(category_stats, model.cfg.d_model, intervals)
+
+def report(category_stats, d_model, intervals=None):
+    """
+    Compute the metrics from per-category RunningStats and save them, with bootstrap
+    intervals (see bootstrap.bootstrap_compound_metrics) when available.
+    """
+    empty = RunningStats(d_model)
+    stats_w = category_stats.get("modifier", empty)               # ' washing' tokens
+    stats_wm = category_stats.get("compound_head", empty)         # ' machine' when preceded by ' washing'
+    stats_m_other = category_stats.get("other_head", empty)       # ' machine' when NOT preceded by ' washing'
+    # Note: other_head could be "sewing machine", "time machine", etc.
+
+    count_w, count_wm, count_m = stats_w.count, stats_wm.count, stats_m_other.count
+
+    print(f"Collected counts:")
+    print(f"  ' washing': {count_w}")
+    print(f"  ' washing machine': {count_wm}")
+    print(f"  ' machine' (other): {count_m}")
+
+    # Analysis
+    if count_wm < 5 or count_m < 5 or count_w < 5:
+        print("WARNING: Not enough data for robust analysis.")
+
+    # Compute means
+    mean_w = stats_w.mean if count_w else np.zeros(768)
+    mean_wm = stats_wm.mean if count_wm else np.zeros(768)
+    mean_m_other = stats_m_other.mean if count_m else np.zeros(768)
+
+    sim_wm_m = cosine_sim(mean_wm, mean_m_other)
+    print(f"Cosine Sim (Washing Machine vs Other Machine): {sim_wm_m:.4f}")
+
+    # 2. Vector Difference: What does "washing" add to "machine"?
+    diff_vector = mean_wm - mean_m_other
+
+    # 3. Does this difference align with the "washing" vector?
+    sim_diff_w = cosine_sim(diff_vector, mean_w)
+    print(f"Cosine Sim ((WM - M) vs Washing): {sim_diff_w:.4f}")
+
+    # 4. Check linearity: wm approx m + w?
+    # composition = mean_m_other + mean_w
+    # sim_composition = cosine_sim(mean_wm, composition)
+    # print(f"Cosine Sim (WM vs (M + W)): {sim_composition:.4f}")
+
+    # 5. Centered similarity and decomposition WM ≈ α*W + β*M, from the accumulated means only
+    center = (mean_w + mean_wm + mean_m_other) / 3
+    sim_wm_m_centered = centered_cosine(mean_wm, mean_m_other, center)
+    (alpha_w, beta_m), r2, resid_ratio = mean_regression(mean_wm, [mean_w, mean_m_other])
+    print(f"Centered Cosine Sim (Washing Machine vs Other Machine): {sim_wm_m_centered:.4f}")
+    print(f"Decomposition: alpha_w={alpha_w:.4f} beta_m={beta_m:.4f} R2={r2:.4f}")
+
+    # Save results
+    results = {
+        "counts": {
+            "washing": count_w,
+            "washing_machine": count_wm,
+            "other_machine": count_m
+        },
+        "metrics": {
+            "sim_wm_vs_m_other": float(sim_wm_m),
+            "sim_diff_vs_washing": float(sim_diff_w),
+            "sim_wm_vs_m_other_centered": float(sim_wm_m_centered),
+            "alpha_w": float(alpha_w),
+            "beta_m": float(beta_m),
+            "r2": float(r2),
+            "resid_ratio": float(resid_ratio)
+        }
     }
-}
 
-with open(os.path.join(RESULTS_DIR, "experiment_metrics.json"), "w") as f:
-    json.dump(results, f, indent=2)
+    if intervals is not None:
+        ci = intervals["sim_wm_m"]
+        print(f"Cosine Sim (Washing Machine vs Other Machine) 95% CI: [{ci['low']:.4f}, {ci['high']:.4f}]")
+        results["intervals"] = intervals
+
+    with open(os.path.join(RESULTS_DIR, "experiment_metrics.json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+    print("Experiment complete. Results saved.")
 
-print("Experiment complete. Results saved.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+from transformer_lens import HookedTransformer
+import matplotlib.pyplot as plt
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from activation_patching import tokenize_pairs, activation_patching, align_to_end
+from attribution_patching import attribution_patching
+
+# Configuration
+DEVICE = "cpu"
+MODEL_NAME = "gpt2-small"
+RESULTS_DIR = "results"
+HOOK_POINT = "hook_resid_pre"
+# Patch sites per forward pass
+MAX_ROWS = 1024
+# "exact": patch every site; "attribution": gradient estimate for every residual and
+# attention-head site from one forward/backward, with the top VERIFY_TOP_K sites re-run exactly
+MODE = "exact"
+VERIFY_TOP_K = 20
+
+# Each context ends right before the head; the clean prompt ends in " washing", the
+# corrupted ones in a modifier of the same token length that does not call for " machine".
+CONTEXTS = [
+    "The clothes are still in the{}",
+    "I need to buy a new{}",
+    "Yesterday our old{}",
+    "She loaded the dirty towels into the{}",
+    "The repairman fixed the{}",
+    "Please empty the{}",
+    "He bought a cheap second-hand{}",
+    "The noise came from the{}",
+    "We had to replace the{}",
+    "Water leaked out of the{}",
+]
+CLEAN_MODIFIER = " washing"
+CORRUPT_MODIFIERS = [" eating", " running", " cooking"]
+ANSWER = " machine"
+# Pairs whose clean - corrupt logit gap is below this are dropped before normalising
+MIN_GAP = 1.0
+
+os.makedirs(os.path.join(RESULTS_DIR, "figures"), exist_ok=True)
+
+print(f"Loading model {MODEL_NAME}...")
+model = HookedTransformer.from_pretrained(MODEL_NAME, device=DEVICE)
+model.eval()
+
+clean_prompts, corrupt_prompts = [], []
+for context in CONTEXTS:
+    for corrupt in CORRUPT_MODIFIERS:
+        clean_prompts.append(context.format(CLEAN_MODIFIER))
+        corrupt_prompts.append(context.format(corrupt))
+clean_seqs, corrupt_seqs = tokenize_pairs(model, clean_prompts, corrupt_prompts)
+answer_id = model.to_single_token(ANSWER)
+
+print(f"Patching {len(clean_seqs)} pairs ({MODE})...")
+if MODE == "attribution":
+    out = attribution_patching(
+        model, clean_seqs, corrupt_seqs, answer_id, hook_points=[HOOK_POINT, "attn.hook_z"],
+        verify_top_k=VERIFY_TOP_K, max_rows=MAX_ROWS,
+    )
+    out["patched"] = out["corrupt"][:, None, None] + out["estimates"][HOOK_POINT]
+else:
+    out = activation_patching(
+        model, clean_seqs, corrupt_seqs, answer_id, hook_point=HOOK_POINT, max_rows=MAX_ROWS, min_gap=MIN_GAP
+    )
+print(f"Mean {ANSWER!r} logit: clean={out['clean'].mean():.3f} corrupt={out['corrupt'].mean():.3f}")
+
+kept = np.abs(out["clean"] - out["corrupt"]) >= MIN_GAP
+dropped = [int(p) for p in np.nonzero(~kept)[0]]
+for p in dropped:
+    print(f"  Dropping pair {p} ({corrupt_prompts[p]!r}): clean - corrupt = {out['clean'][p] - out['corrupt'][p]:.3f}")
+if not kept.any():
+    raise ValueError(f"No pair has a clean - corrupt gap of at least {MIN_GAP}")
+
+# Positions counted from the end, so prompts of different lengths line up on the modifier
+max_len = out["patched"].shape[-1]
+aligned = align_to_end(out["patched"], [len(s) for s in clean_seqs])
+gap = np.mean(out["clean"][kept] - out["corrupt"][kept])
+recovered = np.nanmean(aligned[kept] - out["corrupt"][kept, None, None], axis=0) / gap
+offsets = list(range(-max_len, 0))
+
+results = {
+    "mode": MODE,
+    "hook_point": HOOK_POINT,
+    "layers": out["layers"],
+    "position_offsets": offsets,
+    "clean": out["clean"].tolist(),
+    "corrupt": out["corrupt"].tolist(),
+    "min_gap": MIN_GAP,
+    "dropped_pairs": dropped,
+    "recovered": [[None if np.isnan(v) else float(v) for v in row] for row in recovered],
+}
+if MODE == "attribution":
+    # Per head: estimated effect summed over positions, mean over pairs [layers, heads]
+    results["head_attribution"] = np.nanmean(np.nansum(out["estimates"]["attn.hook_z"][kept], axis=2), axis=0).tolist()
+    results["verified"] = out["verified"]
+    for site in out["verified"]:
+        exact = f"{site['exact']:.3f}" if site["exact"] is not None else "n/a"
+        print(f"  {site['hook_point']} L{site['layer']} offset {site['offset']} head {site['head']}: "
+              f"estimate={site['estimate']:.3f} exact={exact}")
+
+with open(os.path.join(RESULTS_DIR, f"patching_results_{MODE}.json"), "w") as f:
+    json.dump(results, f, indent=2)
+
+plt.figure(figsize=(10, 6))
+plt.imshow(recovered, aspect="auto", cmap="RdBu", vmin=-1, vmax=1, origin="lower")
+plt.colorbar(label="Fraction of clean logit recovered")
+plt.xticks(range(len(offsets)), offsets)
+plt.yticks(range(len(out["layers"])), out["layers"])
+plt.xlabel("Position (from the end; -1 = modifier)")
+plt.ylabel("Layer")
+plt.title(f"{MODE.capitalize()} patching ({HOOK_POINT}): {ANSWER!r} logit")
+plt.savefig(os.path.join(RESULTS_DIR, "figures", f"patching_heatmap_{MODE}.png"))
+print("Patching complete. Results saved.")
@@ -0,0 +1,71 @@
+from transformer_lens import HookedTransformer
+from datasets import load_from_disk
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from token_cache import cached_tokenize
+from token_index import cached_token_index, ngram_postings
+from compound_sweep import parse_compound, load_compounds
+from prediction_profile import profile_next_tokens
+
+# Configuration
+DEVICE = "cpu"
+MODEL_NAME = "gpt2-small"
+DATASET_PATH = "datasets/washing_machine_corpus"
+RESULTS_DIR = "results"
+BATCH_SIZE = 32
+# Vocabulary columns per step of the exact log-partition
+VOCAB_CHUNK = 4096
+
+if not os.path.exists(RESULTS_DIR):
+    os.makedirs(RESULTS_DIR)
+
+compounds = load_compounds()
+
+print(f"Loading model {MODEL_NAME}...")
+model = HookedTransformer.from_pretrained(MODEL_NAME, device=DEVICE)
+model.eval()
+
+print(f"Loading dataset from {DATASET_PATH}...")
+dataset = load_from_disk(DATASET_PATH)
+texts = [example['text'] for example in dataset['train']]
+token_seqs = cached_tokenize(model, texts, prepend_bos=True)
+token_index = cached_token_index(model, texts, lambda: token_seqs)
+
+# One group per modifier: every occurrence of it, predicting the next token.
+# Candidates are the first token of every compound head, so each modifier is scored
+# against its own head and all the others (P(" machine" | " washing") vs " sewing" ...).
+compound_ids = {name: parse_compound(model, name) for name in compounds}
+groups = {}
+modifier_of = {}
+for name, (modifier, head) in compound_ids.items():
+    modifier_str = " " + " ".join(name.split()[:-1])
+    modifier_of[name] = modifier_str
+    if modifier_str not in groups:
+        docs, positions = ngram_postings(token_index, modifier, anchor=-1)
+        groups[modifier_str] = list(zip(docs.tolist(), positions.tolist()))
+candidate_ids = sorted({head[0] for _, head in compound_ids.values()})
+
+print(f"Profiling {sum(len(ts) for ts in groups.values())} modifier occurrences "
+      f"against {len(candidate_ids)} candidate heads...")
+profile = profile_next_tokens(
+    model, token_seqs, groups, candidate_ids, batch_size=BATCH_SIZE, vocab_chunk=VOCAB_CHUNK
+)
+
+rows = []
+for name, (modifier, head) in compound_ids.items():
+    group = profile[modifier_of[name]]
+    stats = group["candidates"][head[0]]
+    rows.append({"compound": name, "modifier_count": group["count"], "head_token": head[0], "head": stats})
+    if stats is None:
+        print(f"  {name!r}: modifier not found")
+        continue
+    print(f"  {name!r}: n={group['count']} P(head)={stats['mean_prob']:.4f} "
+          f"mean rank={stats['mean_rank']:.1f} top1={stats['top1_rate']:.3f}")
+
+with open(os.path.join(RESULTS_DIR, "prediction_profile.json"), "w") as f:
+    json.dump({"compounds": rows, "profile": profile, "candidate_ids": candidate_ids}, f, indent=2)
+
+print("Prediction profile complete. Results saved.")
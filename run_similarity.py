@@ -0,0 +1,90 @@
+from transformer_lens import HookedTransformer
+from datasets import load_from_disk
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from activation_extractor import extract_indexed_activations, layer_hook_names
+from activation_store import dataset_fingerprint, cached_activations
+from token_cache import cached_tokenize
+from token_index import cached_token_index, compound_targets
+from similarity import cosine_topk, neighbor_category_stats, mean_pairwise_cosine
+from ann_index import cached_ann_index, evaluate_ann
+
+# Configuration
+DEVICE = "cpu"
+MODEL_NAME = "gpt2-small"
+DATASET_PATH = "datasets/washing_machine_corpus"
+RESULTS_DIR = "results"
+BATCH_SIZE = 32
+# Neighbors per occurrence, and rows per block of the similarity matrix
+TOP_K = 10
+BLOCK_ROWS = 2048
+# Approximate index (IVF) per layer, checked against the exact search above
+ANN_N_PROBES = [1, 2, 4, 8, 16, 32]
+
+if not os.path.exists(RESULTS_DIR):
+    os.makedirs(RESULTS_DIR)
+
+print(f"Loading model {MODEL_NAME}...")
+model = HookedTransformer.from_pretrained(MODEL_NAME, device=DEVICE)
+model.eval()
+
+print(f"Loading dataset from {DATASET_PATH}...")
+dataset = load_from_disk(DATASET_PATH)
+texts = [example['text'] for example in dataset['train']]
+
+token_seqs = cached_tokenize(model, texts)
+token_index = cached_token_index(model, texts, lambda: token_seqs)
+token_washing = model.to_single_token(" washing")
+token_machine = model.to_single_token(" machine")
+
+# Every occurrence at every layer, in one pass (re-runs load from the activation store)
+hook_names = layer_hook_names("hook_resid_post", model.cfg.n_layers - 1)
+fingerprint = dataset_fingerprint(texts, f"compound_masks: washing={token_washing} machine={token_machine}")
+vectors, index = cached_activations(
+    lambda out_dir: extract_indexed_activations(
+        model, token_seqs, hook_names=hook_names, batch_size=BATCH_SIZE,
+        category_targets=compound_targets(token_index, [token_washing], [token_machine]), out_dir=out_dir,
+    ),
+    MODEL_NAME,
+    hook_names,
+    fingerprint,
+    stream=True,
+)
+categories = list(index["categories"])
+labels = index["labels"]
+print(f"{len(vectors)} occurrences, {len(hook_names)} layers")
+
+layers = []
+for layer in range(len(hook_names)):
+    neighbors, sims = cosine_topk(vectors, k=TOP_K, hook=layer, block_rows=BLOCK_ROWS)
+    stats = neighbor_category_stats(neighbors, labels, categories)
+    pairwise = mean_pairwise_cosine(vectors, labels, hook=layer)
+    layers.append({
+        "layer": layer,
+        "neighbors": stats,
+        "mean_topk_cosine": float(sims.mean()) if sims.size else None,
+        "ann": evaluate_ann(
+            vectors, cached_ann_index(vectors, MODEL_NAME, hook_names, fingerprint, hook=layer),
+            hook=layer, k=TOP_K, n_probes=ANN_N_PROBES,
+        ),
+        "mean_pairwise_cosine": {
+            a: {b: None if np.isnan(pairwise[i, j]) else float(pairwise[i, j])
+                for j, b in enumerate(categories)}
+            for i, a in enumerate(categories)
+        },
+    })
+    head = stats.get("compound_head")
+    if head and head["count"]:
+        print(f"  layer {layer}: compound_head neighbors that are compound_head: "
+              f"{head['neighbor_fraction']['compound_head']:.3f} "
+              f"(base rate {head['base_rate']['compound_head']:.3f})")
+
+with open(os.path.join(RESULTS_DIR, "neighbor_similarity.json"), "w") as f:
+    json.dump({"top_k": TOP_K, "categories": categories, "layers": layers}, f, indent=2)
+
+print("Similarity analysis complete. Results saved.")
@@ -1,15 +1,22 @@
 import torch
 from transformer_lens import HookedTransformer
 import numpy as np
-from tqdm import tqdm
 import json
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from activation_extractor import extract_indexed_activations, activations_by_category
+from token_patterns import compound_masks
+from activation_store import dataset_fingerprint, cached_activations
+from token_cache import cached_tokenize
 
 # Configuration
 DEVICE = "cpu"
 MODEL_NAME = "gpt2-small"
 DATASET_PATH = "datasets/synthetic/dataset.json"
 RESULTS_DIR = "results"
+BATCH_SIZE = 32
 
 if not os.path.exists(RESULTS_DIR):
     os.makedirs(RESULTS_DIR)
@@ -30,56 +37,37 @@ token_washing = model.to_single_token(" washing")
 print(f"Target Token ' machine': {token_machine}")
 print(f"Target Token ' washing': {token_washing}")
 
-activations_washing_machine = [] # ' machine' in ' washing machine'
-activations_other_machine = []   # ' machine' in ' [other] machine' or ' machine'
-activations_washing_verb = []    # ' washing' in ' washing [obj]' (NOT machine)
-activations_washing_in_wm = []   # ' washing' in ' washing machine'
-
-count_wm = 0
-count_m_other = 0
-count_w_verb = 0
+# Tokenize every example once (cached across runs), then one forward pass per length-bucketed batch
+print("Tokenizing examples...")
+texts = [item['text'] for item in raw_data]
+token_seqs = cached_tokenize(model, texts, prepend_bos=True)
 
 print("Processing examples...")
-with torch.no_grad():
-    for item in tqdm(raw_data):
-        text = item['text']
-        dataset_type = item['type'] # washing_machine, other_machine, generic_machine, washing_verb
-        
-        tokens = model.to_tokens(text, prepend_bos=True)[0]
-        tokens_list = tokens.tolist()
-        
-        # Run model
-        _, cache = model.run_with_cache(tokens, names_filter=lambda n: n.endswith("resid_post"))
-        resid = cache["blocks.11.hook_resid_post"][0] # Last layer
-        
-        for i, token in enumerate(tokens_list):
-            
-            # Check for ' washing'
-            if token == token_washing:
-                # Is the NEXT token ' machine'?
-                if i + 1 < len(tokens_list) and tokens_list[i+1] == token_machine:
-                    # It is " washing" in " washing machine"
-                    vec = resid[i].cpu().numpy()
-                    activations_washing_in_wm.append(vec)
-                else:
-                    # It is " washing" NOT followed by machine (e.g. washing the car)
-                    vec = resid[i].cpu().numpy()
-                    activations_washing_verb.append(vec)
-                    count_w_verb += 1
-            
-            # Check for ' machine'
-            if token == token_machine:
-                # Is the PREVIOUS token ' washing'?
-                if i > 0 and tokens_list[i-1] == token_washing:
-                    # It is " machine" in " washing machine"
-                    vec = resid[i].cpu().numpy()
-                    activations_washing_machine.append(vec)
-                    count_wm += 1
-                else:
-                    # It is " machine" in other contexts
-                    vec = resid[i].cpu().numpy()
-                    activations_other_machine.append(vec)
-                    count_m_other += 1
+HOOK_NAME = "blocks.11.hook_resid_post" # Last layer
+fingerprint = dataset_fingerprint(texts, f"compound_masks: washing={token_washing} machine={token_machine}")
+vectors, index = cached_activations(
+    lambda: extract_indexed_activations(
+        model,
+        token_seqs,
+        hook_names=[HOOK_NAME],
+        batch_size=BATCH_SIZE,
+        select_masks=lambda tokens, mask: compound_masks(tokens, [token_washing], [token_machine], mask),
+    ),
+    MODEL_NAME,
+    [HOOK_NAME],
+    fingerprint,
+)
+activations = activations_by_category(vectors, index)
+
+empty = np.zeros((0, model.cfg.d_model), dtype=np.float32)
+activations_washing_machine = activations.get("compound_head", empty) # ' machine' in ' washing machine'
+activations_other_machine = activations.get("other_head", empty)      # ' machine' in ' [other] machine' or ' machine'
+activations_washing_verb = activations.get("modifier_alone", empty)   # ' washing' in ' washing [obj]' (NOT machine)
+activations_washing_in_wm = activations.get("modifier_in_compound", empty) # ' washing' in ' washing machine'
+
+count_wm = len(activations_washing_machine)
+count_m_other = len(activations_other_machine)
+count_w_verb = len(activations_washing_verb)
 
 print(f"Collected counts:")
 print(f"  ' washing' (verb): {count_w_verb}")
@@ -0,0 +1,62 @@
+from transformer_lens import HookedTransformer
+from datasets import load_from_disk
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from token_cache import cached_tokenize
+from token_index import cached_token_index, compound_targets
+from window_sweep import window_sweep
+
+# Configuration
+DEVICE = "cpu"
+MODEL_NAME = "gpt2-small"
+DATASET_PATH = "datasets/washing_machine_corpus"
+RESULTS_DIR = "results"
+BATCH_SIZE = 32
+HOOK_NAME = "blocks.11.hook_resid_post"
+# Left-context sizes to compare against the full context (n_ctx - 1 tokens)
+WINDOWS = [256, 128, 64, 32, 16, 8, 4]
+# None: occurrences whose windows overlap share one, each seeing at least `window` tokens.
+# An int k bounds the extra context to k tokens; 0 keeps every occurrence at exactly `window`.
+OVERLAP_SLACK = None
+
+if not os.path.exists(RESULTS_DIR):
+    os.makedirs(RESULTS_DIR)
+
+print(f"Loading model {MODEL_NAME}...")
+model = HookedTransformer.from_pretrained(MODEL_NAME, device=DEVICE)
+model.eval()
+
+print(f"Loading dataset from {DATASET_PATH}...")
+dataset = load_from_disk(DATASET_PATH)
+texts = [example['text'] for example in dataset['train']]
+
+# Untruncated, so occurrences past n_ctx in long paragraphs are kept
+token_seqs = cached_tokenize(model, texts, prepend_bos=True, truncate=False)
+token_index = cached_token_index(model, texts, lambda: token_seqs, truncate=False)
+
+token_washing = model.to_single_token(" washing")
+token_machine = model.to_single_token(" machine")
+category_targets = compound_targets(token_index, [token_washing], [token_machine])
+
+print("Sweeping context windows...")
+rows = window_sweep(
+    model, token_seqs, category_targets, WINDOWS, hook_name=HOOK_NAME, batch_size=BATCH_SIZE,
+    overlap_slack=OVERLAP_SLACK,
+)
+
+for row in rows:
+    sim = row["metrics"]["sim_compound_vs_other_head"]
+    sim_str = f"{sim:.4f}" if sim is not None else "n/a"
+    head_cos = row["mean_cosine_vs_reference"].get("compound_head")
+    head_str = f"{head_cos:.4f}" if head_cos is not None else "n/a"
+    ratio_str = f"{row['tokens_ratio']:.2f}x" if row["tokens_ratio"] is not None else "n/a"
+    print(f"  window={row['window']}: tokens={row['tokens_forwarded']} ({ratio_str}) "
+          f"sim={sim_str} cos(compound_head, reference)={head_str}")
+
+with open(os.path.join(RESULTS_DIR, "context_window_sweep.json"), "w") as f:
+    json.dump(rows, f, indent=2)
+
+print("Window sweep complete. Results saved.")
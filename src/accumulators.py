@@ -0,0 +1,94 @@
+import numpy as np
+
+from decomposition import batched_lstsq
+
+
+class RunningStats:
+    """
+    Streaming mean (and optionally covariance) of activation vectors.
+
+    Batches are folded in with the parallel Welford / Chan update, so only the count,
+    a float64 mean [d_model] and, with track_cov, a [d_model, d_model] scatter matrix
+    are kept, no matter how many vectors pass through. Accumulators from different
+    shards combine exactly with merge().
+    """
+
+    def __init__(self, d_model, track_cov=False):
+        self.d_model = d_model
+        self.track_cov = track_cov
+        self.count = 0
+        self.mean = np.zeros(d_model, dtype=np.float64)
+        self.m2 = np.zeros((d_model, d_model), dtype=np.float64) if track_cov else None
+
+    def update(self, batch):
+        """Fold in a batch [n, d_model] (NumPy or torch)."""
+        batch = np.asarray(batch, dtype=np.float64).reshape(-1, self.d_model)
+        if len(batch) == 0:
+            return self
+        batch_mean = batch.mean(axis=0)
+        batch_m2 = None
+        if self.track_cov:
+            centered = batch - batch_mean
+            batch_m2 = centered.T @ centered
+        self._combine(len(batch), batch_mean, batch_m2)
+        return self
+
+    def merge(self, other):
+        """Fold in another RunningStats (e.g. from another shard)."""
+        if other.count:
+            self._combine(other.count, other.mean, other.m2 if self.track_cov else None)
+        return self
+
+    def _combine(self, n_b, mean_b, m2_b):
+        n_a = self.count
+        n = n_a + n_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * (n_b / n)
+        if self.track_cov:
+            self.m2 = self.m2 + m2_b + np.outer(delta, delta) * (n_a * n_b / n)
+        self.count = n
+
+    def covariance(self, ddof=1):
+        if not self.track_cov:
+            raise ValueError("RunningStats was created with track_cov=False")
+        if self.count <= ddof:
+            return np.full((self.d_model, self.d_model), np.nan)
+        return self.m2 / (self.count - ddof)
+
+    def variance(self, ddof=1):
+        return np.diag(self.covariance(ddof))
+
+
+def stats_by_category(vectors, index, hook=0, track_cov=False, chunk_rows=4096):
+    """
+    dict category -> RunningStats from indexed vectors (e.g. a memory-mapped store entry),
+    read chunk_rows at a time so the raw vectors are never all in memory.
+    """
+    d_model = vectors.shape[-1]
+    labels = np.asarray(index["labels"])
+    stats = {cat: RunningStats(d_model, track_cov) for cat in index["categories"]}
+    for start in range(0, len(vectors), chunk_rows):
+        chunk = np.asarray(vectors[start:start + chunk_rows, hook])
+        chunk_labels = labels[start:start + chunk_rows]
+        for c, cat in enumerate(index["categories"]):
+            stats[cat].update(chunk[chunk_labels[:, c]])
+    return stats
+
+
+def cosine_sim(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def centered_cosine(a, b, center):
+    """Cosine of a and b after subtracting a shared center (as in analysis_refined.py)."""
+    return cosine_sim(a - center, b - center)
+
+
+def mean_regression(target, basis):
+    """
+    Least squares target ≈ sum_k coef_k * basis_k without intercept, treating the
+    d_model dimensions as samples (as in analysis_orthogonal.py).
+    Returns (coefs, r2, resid_ratio); r2 is sklearn's score (centered total sum of squares).
+    """
+    fit = batched_lstsq(target, np.stack(basis, axis=1))
+    return fit["coefs"], float(fit["r2"]), float(fit["resid_ratio"])
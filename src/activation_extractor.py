@@ -0,0 +1,553 @@
+import fnmatch
+import os
+
+import torch
+import numpy as np
+
+from accumulators import RunningStats
+from forward_cache import forward_key
+from token_patterns import mask_to_indices
+
+
+def tokenize_corpus(model, texts, prepend_bos=True, truncate=True):
+    """
+    Tokenize the whole corpus in a single tokenizer call.
+    Returns a list of 1-D LongTensors (unpadded), one per text, truncated to n_ctx
+    unless truncate=False (for context_windows, which never runs whole documents).
+    """
+    texts = list(texts)
+    if prepend_bos:
+        # Same ids as model.to_tokens(text, prepend_bos=True) for GPT-2
+        texts = [model.tokenizer.bos_token + t for t in texts]
+    encoded = model.tokenizer(
+        texts,
+        add_special_tokens=False,
+        truncation=truncate,
+        max_length=model.cfg.n_ctx if truncate else None,
+    )["input_ids"]
+    return [torch.tensor(ids, dtype=torch.long) for ids in encoded]
+
+
+def length_bucketed_batches(lengths, batch_size=32, max_tokens=None):
+    """
+    Group sequence indices into batches of similar length so padding stays small.
+    A batch is closed when it holds batch_size sequences or, if max_tokens is set,
+    when its padded size (n_seqs * longest) would exceed max_tokens.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    current = []
+    for i in order:
+        # Sorted ascending, so lengths[i] is the padded length if i joins
+        too_many_tokens = max_tokens is not None and lengths[i] * (len(current) + 1) > max_tokens
+        if current and (len(current) >= batch_size or too_many_tokens):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def model_pad_token_id(model):
+    """The tokenizer's pad token id, or 0 without one (padding is masked out anyway)."""
+    return model.tokenizer.pad_token_id if model.tokenizer.pad_token_id is not None else 0
+
+
+def pad_batch(token_seqs, pad_token_id=0):
+    """
+    Right-pad a list of 1-D token tensors (or arrays, e.g. token_cache.TokenizedCorpus views).
+    Returns tokens [batch, max_len] and attention_mask [batch, max_len] (1 = real token).
+    Right padding leaves real positions untouched under causal attention, so the
+    activations at those positions match an unpadded forward pass.
+    """
+    max_len = max(len(t) for t in token_seqs)
+    tokens = torch.full((len(token_seqs), max_len), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(token_seqs), max_len), dtype=torch.long)
+    for b, seq in enumerate(token_seqs):
+        tokens[b, :len(seq)] = torch.from_numpy(np.asarray(seq, dtype=np.int64))
+        attention_mask[b, :len(seq)] = 1
+    return tokens, attention_mask
+
+
+def select_corpus_positions(token_seqs, select_masks, chunk_size=256):
+    """
+    Vectorized classification of a whole corpus.
+
+    select_masks: fn(tokens [batch, seq], attention_mask) -> dict category -> bool mask,
+    e.g. lambda t, m: compound_masks(t, [token_washing], [token_machine], m).
+    Sequences are right-padded in chunks of chunk_size and classified with tensor ops.
+    Returns dict category -> list of (doc_id, pos), sorted.
+    """
+    category_targets = {}
+    for start in range(0, len(token_seqs), chunk_size):
+        chunk = token_seqs[start:start + chunk_size]
+        if not chunk:
+            continue
+        tokens, attention_mask = pad_batch(chunk)
+        for cat, mask in select_masks(tokens, attention_mask).items():
+            batch_idx, positions = mask_to_indices(mask)
+            category_targets.setdefault(cat, []).extend(
+                zip((batch_idx + start).tolist(), positions.tolist())
+            )
+    return category_targets
+
+
+def resolve_hook_names(model, hook_names):
+    """
+    Expand hook names / glob patterns (e.g. "blocks.*.hook_resid_post") into concrete
+    hook point names, in the order the hooks fire during a forward pass.
+    """
+    if isinstance(hook_names, str):
+        hook_names = [hook_names]
+    resolved = []
+    for name in model.hook_dict:
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in hook_names) and name not in resolved:
+            resolved.append(name)
+    missing = [p for p in hook_names if not any(fnmatch.fnmatchcase(n, p) for n in resolved)]
+    if missing:
+        raise ValueError(f"No hook points match {missing}")
+    return resolved
+
+
+def layer_hook_names(hook_point="hook_resid_post", max_layer=11, min_layer=0):
+    """Hook names for one hook point over a range of layers, e.g. blocks.0-5.hook_resid_post."""
+    return [f"blocks.{L}.{hook_point}" for L in range(min_layer, max_layer + 1)]
+
+
+def stop_layer_for_hooks(hook_names):
+    """
+    The stop_at_layer to pass to the model so the forward pass halts right after the
+    deepest requested hook has fired (TransformerLens treats stop_at_layer as exclusive).
+    Embedding hooks need no blocks (0). Hooks after the blocks (ln_final.*, unembed.*)
+    need the full model (None).
+    """
+    deepest = -1
+    for name in hook_names:
+        if name.startswith("blocks."):
+            deepest = max(deepest, int(name.split(".")[1]))
+        elif not name.startswith(("hook_embed", "hook_pos_embed", "hook_tokens")):
+            return None
+    return deepest + 1
+
+
+def gather_residuals(model, tokens, batch_idx, positions, hook_names, attention_mask=None,
+                     early_exit=True):
+    """
+    Run one forward pass on a padded batch and keep only the target rows.
+
+    Forward hooks copy act[batch_idx, positions] into a preallocated
+    [n_targets, n_hooks, d_model] tensor as each hook point fires, so the full
+    [batch, seq, d_model] activation of a layer is never retained after its hook.
+    Peak extra memory is O(n_targets * n_hooks * d_model) instead of the whole cache.
+
+    With early_exit, the forward pass stops after the deepest requested block, so
+    the remaining blocks, ln_final and the unembedding are never computed.
+    """
+    hook_names = resolve_hook_names(model, hook_names)
+    batch_idx = torch.as_tensor(batch_idx, dtype=torch.long, device=tokens.device)
+    positions = torch.as_tensor(positions, dtype=torch.long, device=tokens.device)
+    out = torch.empty(
+        (len(positions), len(hook_names), model.cfg.d_model),
+        dtype=model.cfg.dtype,
+        device=tokens.device,
+    )
+
+    def make_hook(j):
+        def gather_hook(act, hook):
+            out[:, j] = act[batch_idx, positions]
+        return gather_hook
+
+    fwd_hooks = [(name, make_hook(j)) for j, name in enumerate(hook_names)]
+    stop_at_layer = stop_layer_for_hooks(hook_names) if early_exit else None
+    with torch.no_grad():
+        # return_type=None: we only want the hooked rows, not logits
+        model.run_with_hooks(
+            tokens,
+            attention_mask=attention_mask,
+            return_type=None,
+            stop_at_layer=stop_at_layer,
+            fwd_hooks=fwd_hooks,
+        )
+    return out
+
+
+def iter_sequence_residuals(model, token_seqs, targets, hook_names, batch_size=32, max_tokens=None,
+                            early_exit=True, cache=None):
+    """
+    Streaming form of gather_sequence_residuals: yields (target_rows, tensor) per forward
+    batch, where tensor [len(target_rows), n_hooks, d_model] holds the rows for
+    targets[target_rows]. Nothing is kept between batches.
+    """
+    hook_names = resolve_hook_names(model, hook_names)
+    by_seq = {}
+    for t, (seq_idx, pos) in enumerate(targets):
+        if pos < 0:
+            pos += len(token_seqs[seq_idx])
+        by_seq.setdefault(seq_idx, []).append((t, pos))
+
+    # With a cache, only the positions a sequence's entry lacks are gathered, then merged in
+    keys, gather_positions = {}, {}
+    if cache is not None:
+        for seq_idx in list(by_seq.keys()):
+            keys[seq_idx] = forward_key(model.cfg.model_name, token_seqs[seq_idx], hook_names)
+            entry, missing = cache.lookup(keys[seq_idx], [p for _, p in by_seq[seq_idx]])
+            if len(missing):
+                gather_positions[seq_idx] = missing.tolist()
+                continue
+            column = {p: i for i, p in enumerate(entry[0].tolist())}
+            rows, positions = zip(*by_seq.pop(seq_idx))
+            yield list(rows), entry[1][[column[p] for p in positions]]
+
+    seq_ids = list(by_seq.keys())
+    lengths = [len(token_seqs[s]) for s in seq_ids]
+    pad_token_id = model_pad_token_id(model)
+
+    for batch in length_bucketed_batches(lengths, batch_size=batch_size, max_tokens=max_tokens):
+        batch_seqs = [seq_ids[b] for b in batch]
+        tokens, attention_mask = pad_batch([token_seqs[s] for s in batch_seqs], pad_token_id)
+        tokens = tokens.to(model.cfg.device)
+        attention_mask = attention_mask.to(model.cfg.device)
+
+        batch_idx, positions = [], []
+        for row, seq_idx in enumerate(batch_seqs):
+            seq_positions = gather_positions[seq_idx] if cache is not None else [p for _, p in by_seq[seq_idx]]
+            batch_idx.extend([row] * len(seq_positions))
+            positions.extend(seq_positions)
+
+        gathered = gather_residuals(
+            model, tokens, batch_idx, positions, hook_names, attention_mask, early_exit=early_exit
+        ).cpu()
+
+        if cache is None:
+            # gathered rows are already in by_seq order for this batch
+            yield [t for seq_idx in batch_seqs for t, _ in by_seq[seq_idx]], gathered
+            continue
+
+        start = 0
+        batch_rows, batch_vectors = [], []
+        for seq_idx in batch_seqs:
+            n_positions = len(gather_positions[seq_idx])
+            entry = cache.put(keys[seq_idx], gather_positions[seq_idx], gathered[start:start + n_positions])
+            column = {p: i for i, p in enumerate(entry[0].tolist())}
+            rows, seq_positions = zip(*by_seq[seq_idx])
+            batch_rows.extend(rows)
+            batch_vectors.append(entry[1][[column[p] for p in seq_positions]])
+            start += n_positions
+        yield batch_rows, torch.cat(batch_vectors)
+
+
+def gather_sequence_residuals(model, token_seqs, targets, hook_names, batch_size=32, max_tokens=None,
+                              early_exit=True, cache=None):
+    """
+    Gather residual rows for a list of targets over a corpus of unpadded sequences.
+
+    targets: list of (seq_idx, pos); negative positions count from the end of the sequence.
+    Sequences without targets are never run.
+    cache: optional forward_cache.ForwardCache, keyed by (model, tokens, hook set). A
+    sequence whose target rows are all cached is not run again; otherwise only its
+    missing target rows are gathered and added to its entry.
+    Returns a CPU tensor [n_targets, n_hooks, d_model], rows in the order of targets.
+    """
+    hook_names = resolve_hook_names(model, hook_names)
+    out = torch.empty((len(targets), len(hook_names), model.cfg.d_model), dtype=model.cfg.dtype)
+    for rows, vectors in iter_sequence_residuals(
+        model, token_seqs, targets, hook_names, batch_size=batch_size, max_tokens=max_tokens,
+        early_exit=early_exit, cache=cache,
+    ):
+        out[rows] = vectors
+    return out
+
+
+def context_windows(token_seqs, targets, window, keep_bos=True, overlap_slack=None, max_len=None):
+    """
+    Cut a left-context window of `window` tokens ending at each target.
+
+    keep_bos: token 0 of every document (the BOS from tokenize_corpus) is kept as the
+    first token of each window, so a window looks like the start of a document.
+    Targets of one document share a window (causal attention makes each target's
+    rows depend only on the tokens before it):
+      overlap_slack=None  windows whose ranges overlap are merged, so every token is
+                          forwarded once per run of nearby targets; a target sees at
+                          least `window` tokens
+      overlap_slack=k     a target joins a window starting at most k tokens before its
+                          own start, i.e. it sees between window and window + k tokens
+                          (0: only windows with the same start are shared)
+    max_len: no merged window grows beyond max_len tokens (BOS included), e.g. n_ctx.
+
+    Returns (window_seqs, window_targets): a list of 1-D LongTensors and, per input
+    target, its (window_idx, pos), ready for gather_sequence_residuals.
+    """
+    first = 1 if keep_bos else 0
+    starts = []
+    for doc_id, pos in targets:
+        if pos < 0:
+            pos += len(token_seqs[doc_id])
+        starts.append((doc_id, max(first, pos - window + 1), pos))
+
+    window_seqs = []
+    window_targets = [None] * len(targets)
+    runs = []  # [doc_id, start, end, target indices]
+    for t in sorted(range(len(targets)), key=lambda t: starts[t]):
+        doc_id, start, pos = starts[t]
+        run = runs[-1] if runs else None
+        joins = run is not None and run[0] == doc_id
+        if joins:
+            joins = start <= run[2] if overlap_slack is None else start - run[1] <= overlap_slack
+        if joins and max_len is not None:
+            bos = 1 if keep_bos and run[1] > 0 else 0
+            joins = max(run[2], pos) - run[1] + 1 + bos <= max_len
+        if joins:
+            run[2] = max(run[2], pos)
+            run[3].append(t)
+        else:
+            runs.append([doc_id, start, pos, [t]])
+
+    for doc_id, start, end, members in runs:
+        seq = torch.as_tensor(np.asarray(token_seqs[doc_id], dtype=np.int64))
+        pieces = [seq[:1], seq[start:end + 1]] if keep_bos and start > 0 else [seq[start:end + 1]]
+        offset = 1 if keep_bos and start > 0 else 0
+        for t in members:
+            window_targets[t] = (len(window_seqs), starts[t][2] - start + offset)
+        window_seqs.append(torch.cat(pieces))
+    return window_seqs, window_targets
+
+
+def model_context_windows(model, token_seqs, targets, window, keep_bos=True, overlap_slack=None):
+    """context_windows capped at the model's n_ctx; raises ValueError if a window cannot fit."""
+    window_seqs, window_targets = context_windows(
+        token_seqs, targets, window, keep_bos, overlap_slack, max_len=model.cfg.n_ctx
+    )
+    longest = max((len(seq) for seq in window_seqs), default=0)
+    if longest > model.cfg.n_ctx:
+        raise ValueError(f"Context window of {longest} tokens exceeds n_ctx={model.cfg.n_ctx}")
+    return window_seqs, window_targets
+
+
+def gather_window_residuals(model, token_seqs, targets, hook_names, window, batch_size=32, max_tokens=None,
+                            keep_bos=True, overlap_slack=None, cache=None):
+    """
+    gather_sequence_residuals over left-context windows instead of whole documents:
+    compute is ~ n_windows x window tokens, and documents longer than n_ctx (see
+    tokenize_corpus(truncate=False)) are fine as long as each window fits.
+    Returns a CPU tensor [n_targets, n_hooks, d_model], rows in the order of targets.
+    """
+    window_seqs, window_targets = model_context_windows(model, token_seqs, targets, window, keep_bos, overlap_slack)
+    return gather_sequence_residuals(
+        model, window_seqs, window_targets, hook_names, batch_size=batch_size, max_tokens=max_tokens, cache=cache
+    )
+
+
+def accumulate_category_stats(model, token_seqs, select_masks, hook_name="blocks.11.hook_resid_post",
+                              batch_size=32, max_tokens=None, track_cov=False, cache=None):
+    """
+    Streaming extraction: dict category -> accumulators.RunningStats.
+
+    Each forward batch is folded into the per-category accumulators and dropped, so
+    memory stays O(d_model^2) at most regardless of how many occurrences there are.
+    """
+    category_targets = select_corpus_positions(token_seqs, select_masks)
+    targets = sorted({t for ts in category_targets.values() for t in ts})
+    row_of = {t: r for r, t in enumerate(targets)}
+    # Membership of each target row per category
+    members = {}
+    for cat, ts in category_targets.items():
+        member = np.zeros(len(targets), dtype=bool)
+        member[[row_of[t] for t in ts]] = True
+        members[cat] = member
+
+    stats = {cat: RunningStats(model.cfg.d_model, track_cov) for cat in category_targets}
+    for rows, vectors in iter_sequence_residuals(
+        model, token_seqs, targets, [hook_name], batch_size=batch_size, max_tokens=max_tokens, cache=cache
+    ):
+        vectors = vectors[:, 0].numpy()
+        rows = np.asarray(rows)
+        for cat, member in members.items():
+            stats[cat].update(vectors[member[rows]])
+    return stats
+
+
+def extract_indexed_activations(model, token_seqs, select_positions=None, hook_names="blocks.11.hook_resid_post",
+                                batch_size=32, max_tokens=None, cache=None, select_masks=None,
+                                category_targets=None, context_window=None, out_dir=None):
+    """
+    Extract each selected position once and describe it with a small index.
+
+    Positions come from select_masks (vectorized, see select_corpus_positions), from
+    select_positions: fn(tokens_list) -> dict category -> list of positions, or ready-made
+    category_targets: dict category -> list of (doc_id, pos), e.g. from
+    token_index.compound_targets, in which case the corpus is not scanned at all.
+    With context_window set, each row is computed from at least the context_window
+    tokens ending at it (see gather_window_residuals) instead of the whole document.
+    Rows are written batch by batch as the forwards run; with out_dir they go straight
+    to out_dir/vectors.npy through a memmap (see activation_store.cached_activations
+    with stream=True), so memory does not grow with the number of occurrences.
+
+    Returns (vectors, index):
+      vectors  float32 [n_rows, n_hooks, d_model] (np.memmap with out_dir), rows sorted
+               by (document, position)
+      index    dict with "doc_id", "position", "token_id" arrays [n_rows], "categories"
+               (list of names) and "labels" bool [n_rows, n_categories]; a row can carry
+               several labels (e.g. modifier and modifier_alone).
+    """
+    # Classify on the host first so we only forward documents that matter
+    if category_targets is not None:
+        category_targets = {cat: sorted(ts) for cat, ts in category_targets.items()}
+    elif select_masks is not None:
+        category_targets = select_corpus_positions(token_seqs, select_masks)
+    else:
+        category_targets = {}
+        for doc_id, seq in enumerate(token_seqs):
+            for cat, pos_list in select_positions(seq.tolist()).items():
+                category_targets.setdefault(cat, []).extend((doc_id, pos) for pos in pos_list)
+    categories = list(category_targets.keys())
+
+    # A position can belong to several categories; gather it once
+    targets = sorted({t for cat in categories for t in category_targets[cat]})
+    row_of = {t: r for r, t in enumerate(targets)}
+    hook_names = resolve_hook_names(model, hook_names)
+    if context_window is not None:
+        seqs, seq_targets = model_context_windows(model, token_seqs, targets, context_window)
+    else:
+        seqs, seq_targets = token_seqs, targets
+    shape = (len(targets), len(hook_names), model.cfg.d_model)
+    if out_dir is not None:
+        vectors = np.lib.format.open_memmap(os.path.join(out_dir, "vectors.npy"), mode="w+", dtype=np.float32,
+                                            shape=shape)
+    else:
+        vectors = np.empty(shape, dtype=np.float32)
+    for rows, batch_vectors in iter_sequence_residuals(
+        model, seqs, seq_targets, hook_names, batch_size=batch_size, max_tokens=max_tokens, cache=cache
+    ):
+        vectors[rows] = batch_vectors.float().numpy()
+    if out_dir is not None:
+        vectors.flush()
+
+    labels = np.zeros((len(targets), len(categories)), dtype=bool)
+    for c, cat in enumerate(categories):
+        labels[[row_of[t] for t in category_targets[cat]], c] = True
+    return vectors, build_index(token_seqs, targets, categories, labels)
+
+
+def build_index(token_seqs, targets, categories, labels=None):
+    """
+    Index describing extracted rows: doc id, position, token id and category labels.
+    targets: list of (doc_id, pos). Without labels every row gets every category.
+    """
+    positions = [p if p >= 0 else p + len(token_seqs[d]) for d, p in targets]
+    if labels is None:
+        labels = np.ones((len(targets), len(categories)), dtype=bool)
+    return {
+        "doc_id": np.array([d for d, _ in targets], dtype=np.int64),
+        "position": np.array(positions, dtype=np.int64),
+        "token_id": np.array([int(token_seqs[d][p]) for (d, _), p in zip(targets, positions)], dtype=np.int64),
+        "categories": list(categories),
+        "labels": labels,
+    }
+
+
+def activations_by_category(vectors, index, hook=0):
+    """Split indexed vectors into dict category -> [n_occurrences, d_model] for one hook."""
+    activations = {}
+    for c, cat in enumerate(index["categories"]):
+        rows = np.flatnonzero(index["labels"][:, c])
+        activations[cat] = np.asarray(vectors[rows, hook])
+    return activations
+
+
+def extract_activations(model, token_seqs, select_positions=None, hook_name="blocks.11.hook_resid_post",
+                        batch_size=32, max_tokens=None, cache=None, select_masks=None):
+    """
+    Batched replacement for the per-example run_with_cache loop.
+
+    token_seqs: list of 1-D token tensors (see tokenize_corpus).
+    select_positions / select_masks: see extract_indexed_activations.
+    Sequences with no selected positions are never run through the model, and only
+    the selected rows are gathered (see gather_residuals).
+
+    Returns dict category -> np.ndarray [n_occurrences, d_model], rows in
+    (document, position) order, i.e. the order the per-example loop produced.
+    """
+    vectors, index = extract_indexed_activations(
+        model, token_seqs, select_positions, [hook_name], batch_size=batch_size, max_tokens=max_tokens,
+        cache=cache, select_masks=select_masks,
+    )
+    return activations_by_category(vectors, index)
+
+
+def check_batched_equivalence(model, texts, hook_names="blocks.11.hook_resid_post", batch_size=2, rtol=1e-4,
+                              atol=1e-4):
+    """
+    Check the batched path against the per-example run_with_cache loop it replaced.
+
+    Every position of every text is gathered through padded, length-bucketed batches
+    (gather_sequence_residuals) and through extract_activations, and each is compared
+    with torch.allclose to run_with_cache on that text alone. Use texts of different
+    lengths so that padding is exercised.
+    Returns the largest absolute difference; raises ValueError on a mismatch.
+    """
+    hook_names = resolve_hook_names(model, hook_names)
+    token_seqs = tokenize_corpus(model, texts)
+    targets = [(s, pos) for s, seq in enumerate(token_seqs) for pos in range(len(seq))]
+
+    expected = []
+    with torch.no_grad():
+        for seq in token_seqs:
+            _, run_cache = model.run_with_cache(seq[None].to(model.cfg.device), names_filter=hook_names)
+            expected.append(torch.stack([run_cache[name][0] for name in hook_names], dim=1).cpu())
+    expected = torch.cat(expected)
+
+    gathered = gather_sequence_residuals(model, token_seqs, targets, hook_names, batch_size=batch_size)
+    extracted = [
+        torch.from_numpy(np.asarray(extract_activations(
+            model, token_seqs, lambda tokens: {"all": list(range(len(tokens)))}, name, batch_size=batch_size
+        )["all"]))
+        for name in hook_names
+    ]
+    max_diff = 0.0
+    for label, actual in [("gather_sequence_residuals", gathered), ("extract_activations", torch.stack(extracted, 1))]:
+        actual = actual.to(expected.dtype)
+        max_diff = max(max_diff, (actual - expected).abs().max().item())
+        if not torch.allclose(actual, expected, rtol=rtol, atol=atol):
+            raise ValueError(
+                f"{label} differs from run_with_cache by up to {(actual - expected).abs().max().item():.3g}"
+            )
+    return max_diff
+
+
+def word_activations(model, prompts, words, hook_names, model_name=None, cache=None):
+    """
+    Residual rows at every occurrence of each word (e.g. " machine") in prompts, for
+    the analysis scripts.
+
+    Prompts are tokenized once per corpus (token_cache: re-runs slice the cached ids);
+    occurrences are resolved by token id, or by character span for multi-token words
+    (position_resolver), and prompts missing a word are reported rather than guessed.
+    All words are gathered in one batched forward that keeps only their rows, and the
+    result is kept in the activation store, keyed by model_name (default
+    model.cfg.model_name), hooks, prompts and words, for the next run.
+    Returns dict word -> np.ndarray [n_occurrences, n_hooks, d_model].
+    """
+    # Imported here: both modules import this one
+    from token_cache import cached_tokenize
+    from position_resolver import resolve_word_positions, missing_documents
+    from activation_store import dataset_fingerprint, cached_activations
+
+    words = list(words)
+    hook_names = resolve_hook_names(model, hook_names)
+    token_seqs = cached_tokenize(model, prompts)
+    word_targets = {}
+    for word in words:
+        word_targets[word] = resolve_word_positions(model, prompts, token_seqs, word)
+        missing = missing_documents(len(prompts), word_targets[word])
+        if missing:
+            print(f"WARNING: {word!r} not found in: {[prompts[i] for i in missing]}")
+
+    def extract():
+        return extract_indexed_activations(
+            model, token_seqs, hook_names=hook_names, cache=cache, category_targets=word_targets
+        )
+
+    fingerprint = dataset_fingerprint(prompts, f"word positions: {words!r}")
+    vectors, index = cached_activations(extract, model_name or model.cfg.model_name, hook_names, fingerprint)
+    return {word: np.asarray(vectors[index["labels"][:, c]]) for c, word in enumerate(index["categories"])}
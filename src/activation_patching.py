@@ -0,0 +1,205 @@
+import numpy as np
+import torch
+
+from activation_extractor import tokenize_corpus, model_pad_token_id, pad_batch, layer_hook_names
+
+# Hook whose output is right before the unembedding
+FINAL_HOOK = "ln_final.hook_normalized"
+
+
+def tokenize_pairs(model, clean_prompts, corrupt_prompts, prepend_bos=True):
+    """
+    Tokenize clean / corrupted prompt pairs, which must have the same number of tokens
+    (e.g. " washing" vs " eating") so that positions line up.
+    Returns (clean_seqs, corrupt_seqs), lists of 1-D token tensors.
+    """
+    if len(clean_prompts) != len(corrupt_prompts):
+        raise ValueError(f"{len(clean_prompts)} clean prompts for {len(corrupt_prompts)} corrupted prompts")
+    clean_seqs = tokenize_corpus(model, clean_prompts, prepend_bos=prepend_bos)
+    corrupt_seqs = tokenize_corpus(model, corrupt_prompts, prepend_bos=prepend_bos)
+    mismatched = [i for i, (a, b) in enumerate(zip(clean_seqs, corrupt_seqs)) if len(a) != len(b)]
+    if mismatched:
+        raise ValueError(f"Clean and corrupted prompts differ in length for pairs {mismatched}")
+    return clean_seqs, corrupt_seqs
+
+
+def per_pair_ids(token_ids, n_pairs):
+    """One token id, or one per pair, as a writable int64 array [n_pairs] (None stays None)."""
+    if token_ids is None:
+        return None
+    return np.broadcast_to(np.asarray(token_ids, dtype=np.int64), (n_pairs,)).copy()
+
+
+def answer_metric(model, normed, answer_ids, wrong_ids=None):
+    """
+    Logit of each row's answer token (minus the logit of its wrong token, if given)
+    from ln_final output rows [n, d_model], using only the gathered W_U columns.
+    """
+    answer_ids = torch.as_tensor(answer_ids, dtype=torch.long, device=normed.device)
+    metric = (normed * model.W_U[:, answer_ids].T).sum(-1) + model.b_U[answer_ids]
+    if wrong_ids is not None:
+        wrong_ids = torch.as_tensor(wrong_ids, dtype=torch.long, device=normed.device)
+        metric = metric - ((normed * model.W_U[:, wrong_ids].T).sum(-1) + model.b_U[wrong_ids])
+    return metric
+
+
+def run_metric(model, tokens, attention_mask, last_pos, answer_ids, wrong_ids=None, fwd_hooks=()):
+    """
+    One forward with fwd_hooks that keeps only the ln_final row at last_pos of each
+    sequence and scores it with answer_metric; the unembedding is never run.
+    """
+    rows = torch.arange(len(tokens), device=tokens.device)
+    final = {}
+
+    def final_hook(act, hook):
+        final["normed"] = act[rows, last_pos]
+
+    with torch.no_grad():
+        model.run_with_hooks(
+            tokens,
+            attention_mask=attention_mask,
+            return_type=None,
+            fwd_hooks=list(fwd_hooks) + [(FINAL_HOOK, final_hook)],
+        )
+        return answer_metric(model, final["normed"], answer_ids, wrong_ids)
+
+
+def pair_batch(model, clean_seqs, corrupt_seqs):
+    """Right-padded clean and corrupted tokens, their attention mask and each pair's last position."""
+    pad_token_id = model_pad_token_id(model)
+    device = model.cfg.device
+    clean_tokens, attention_mask = pad_batch(clean_seqs, pad_token_id)
+    corrupt_tokens, _ = pad_batch(corrupt_seqs, pad_token_id)
+    last_pos = torch.tensor([len(s) - 1 for s in clean_seqs], device=device)
+    return clean_tokens.to(device), corrupt_tokens.to(device), attention_mask.to(device), last_pos
+
+
+def align_to_end(values, lengths):
+    """
+    Right-align per-pair position values [n_pairs, n_layers, max_len, ...] so that
+    column j is offset j - max_len from each pair's end (-1 = last token) and prompts
+    of different lengths line up; nan before each pair's first token.
+    """
+    max_len = values.shape[2]
+    aligned = np.full(values.shape, np.nan, dtype=np.float64)
+    for p, n in enumerate(lengths):
+        aligned[p, :, max_len - n:] = values[p, :, :n]
+    return aligned
+
+
+def store_hooks(acts, hook_names):
+    """Forward hooks that keep the whole activation of each hook in acts[name]."""
+    def store_hook(act, hook):
+        acts[hook.name] = act.detach().clone()
+    return [(name, store_hook) for name in hook_names]
+
+
+def patch_sites(model, corrupt_tokens, attention_mask, last_pos, answer_ids, wrong_ids, clean_acts, hook_names,
+                site_pair, site_hook, site_pos, site_head=None, max_rows=1024):
+    """
+    Answer metric of the corrupted run with one site patched, for many sites at once.
+
+    Site i writes clean_acts[hook_names[site_hook[i]]][site_pair[i], site_pos[i]] (and
+    head site_head[i] for per-head hooks such as attn.hook_z) into a copy of pair
+    site_pair[i]'s corrupted run. Sites are rows of the batch dimension, max_rows per
+    forward, with one patching hook per hook name.
+    answer_ids / wrong_ids: arrays with one id per pair. Returns [n_sites] numpy.
+    """
+    device = corrupt_tokens.device
+    site_pair = torch.as_tensor(site_pair, dtype=torch.long, device=device)
+    site_hook = torch.as_tensor(site_hook, dtype=torch.long, device=device)
+    site_pos = torch.as_tensor(site_pos, dtype=torch.long, device=device)
+    if site_head is not None:
+        site_head = torch.as_tensor(site_head, dtype=torch.long, device=device)
+
+    metrics = []
+    for start in range(0, len(site_pair), max_rows):
+        pairs = site_pair[start:start + max_rows]
+        hooks = site_hook[start:start + max_rows]
+        positions = site_pos[start:start + max_rows]
+        heads = site_head[start:start + max_rows] if site_head is not None else None
+
+        def make_patch_hook(j, name):
+            rows = torch.nonzero(hooks == j)[:, 0]
+            index = (rows, positions[rows]) if heads is None else (rows, positions[rows], heads[rows])
+            source = (pairs[rows], positions[rows]) if heads is None else (pairs[rows], positions[rows], heads[rows])
+            def patch_hook(act, hook):
+                act[index] = clean_acts[name][source]
+                return act
+            return patch_hook
+
+        fwd_hooks = [(name, make_patch_hook(j, name)) for j, name in enumerate(hook_names) if (hooks == j).any()]
+        pair_ids = pairs.cpu().numpy()
+        metrics.append(run_metric(
+            model, corrupt_tokens[pairs], attention_mask[pairs], last_pos[pairs], answer_ids[pair_ids],
+            None if wrong_ids is None else wrong_ids[pair_ids], fwd_hooks,
+        ).cpu().numpy())
+    return np.concatenate(metrics) if metrics else np.zeros(0, dtype=np.float32)
+
+
+def activation_patching(model, clean_seqs, corrupt_seqs, answer_ids, wrong_ids=None, hook_point="hook_resid_pre",
+                        layers=None, max_rows=1024, min_gap=0.0):
+    """
+    Denoising activation patching: for every (pair, layer, position) the clean
+    activation at blocks.{layer}.{hook_point}, position is written into the corrupted
+    run, and the answer metric (see answer_metric) at the last token is recorded.
+
+    Clean and corrupted prompts are each run once (the clean run keeps only the hook
+    activations needed for patching). Every patch site is then a row of the batch
+    dimension (see patch_sites), so a full sweep is
+    n_pairs * n_layers * seq_len / max_rows forwards.
+
+    answer_ids / wrong_ids: one token id, or one per pair.
+    Returns dict:
+      layers      list of layer numbers
+      clean       [n_pairs] metric of the clean run
+      corrupt     [n_pairs] metric of the corrupted run
+      patched     [n_pairs, n_layers, max_len] metric with that site patched (nan past a
+                  pair's length)
+      kept        [n_pairs] bool, |clean - corrupt| >= min_gap
+      recovered   [n_layers, max_len] mean (patched - corrupt) / mean (clean - corrupt)
+                  over kept pairs: 1 = the site alone restores the clean metric, 0 = no
+                  effect. Pairs whose corruption barely moves the metric would only add
+                  noise to the normalisation, hence min_gap.
+    """
+    layers = list(range(model.cfg.n_layers)) if layers is None else sorted(layers)
+    hook_names = [layer_hook_names(hook_point, L, L)[0] for L in layers]
+    n_pairs = len(clean_seqs)
+    answer_ids = per_pair_ids(answer_ids, n_pairs)
+    wrong_ids = per_pair_ids(wrong_ids, n_pairs)
+    clean_tokens, corrupt_tokens, attention_mask, last_pos = pair_batch(model, clean_seqs, corrupt_seqs)
+    max_len = clean_tokens.shape[1]
+
+    # Clean run: keep [n_pairs, seq, d_model] of each patched hook
+    clean_acts = {}
+    clean = run_metric(
+        model, clean_tokens, attention_mask, last_pos, answer_ids, wrong_ids, store_hooks(clean_acts, hook_names)
+    ).cpu().numpy()
+    corrupt = run_metric(model, corrupt_tokens, attention_mask, last_pos, answer_ids, wrong_ids).cpu().numpy()
+
+    # One row per patch site, only at real (unpadded) positions
+    site_pair, site_layer, site_pos = [], [], []
+    for p in range(n_pairs):
+        for j in range(len(layers)):
+            for pos in range(len(clean_seqs[p])):
+                site_pair.append(p)
+                site_layer.append(j)
+                site_pos.append(pos)
+    metric = patch_sites(
+        model, corrupt_tokens, attention_mask, last_pos, answer_ids, wrong_ids, clean_acts, hook_names,
+        site_pair, site_layer, site_pos, max_rows=max_rows,
+    )
+    patched = np.full((n_pairs, len(layers), max_len), np.nan, dtype=np.float32)
+    patched[site_pair, site_layer, site_pos] = metric
+
+    kept = np.abs(clean - corrupt) >= min_gap
+    gap = float(np.mean(clean[kept] - corrupt[kept])) if kept.any() else 0.0
+    recovered = np.nanmean(patched[kept] - corrupt[kept, None, None], axis=0) / (gap if gap != 0 else np.nan)
+    return {
+        "layers": layers,
+        "clean": clean,
+        "corrupt": corrupt,
+        "patched": patched,
+        "kept": kept,
+        "recovered": recovered,
+    }
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Every on-disk cache lives in its own subdirectory of results/ (ignored by git)
+CACHE_ROOT = "results"
+STORE_DIR = os.path.join(CACHE_ROOT, "activation_store")
+
+INDEX_FIELDS = ["doc_id", "position", "token_id", "labels"]
+
+
+def dataset_fingerprint(texts, selection=""):
+    """
+    Hash of the corpus texts plus a description of how positions were selected
+    (e.g. "compound_masks: washing=20518 machine=4572").
+    """
+    h = hashlib.sha256()
+    h.update(selection.encode("utf-8"))
+    for text in texts:
+        # Length prefix so ["ab", "c"] and ["a", "bc"] hash differently
+        data = text.encode("utf-8")
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+def entry_dir(model_name, hook_names, fingerprint, root=STORE_DIR):
+    """Directory holding one (model, hook set, dataset) entry."""
+    if isinstance(hook_names, str):
+        hook_names = [hook_names]
+    hooks_key = hashlib.sha256(",".join(hook_names).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(root, model_name.replace("/", "_"), f"{hooks_key}-{fingerprint[:16]}")
+
+
+def begin_entry(path):
+    """Fresh temporary directory next to path, for files written before atomic_save."""
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    return tmp_path
+
+
+def atomic_save(path, arrays, meta, tmp_path=None):
+    """
+    Write arrays (dict name -> array) as {name}.npy plus meta as meta.json into a
+    temporary directory (begin_entry, unless tmp_path was already started) and rename
+    it over path, so readers never see a half-written entry. meta.json is written
+    last; loaders treat a directory without it as missing.
+    """
+    if tmp_path is None:
+        tmp_path = begin_entry(path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return path
+
+
+def save_activations(vectors, index, model_name, hook_names, fingerprint, root=STORE_DIR, tmp_path=None):
+    """
+    Write vectors [n_rows, n_hooks, d_model] as a .npy file and the index
+    (see activation_extractor.extract_indexed_activations) as .npy columns plus
+    meta.json, atomically (see atomic_save). With tmp_path (from begin_entry), vectors
+    is the memmap already streamed to tmp_path/vectors.npy; only its shape is read.
+    """
+    if isinstance(hook_names, str):
+        hook_names = [hook_names]
+    arrays = {} if tmp_path is not None else {"vectors": np.ascontiguousarray(vectors, dtype=np.float32)}
+    arrays.update({field: index[field] for field in INDEX_FIELDS})
+    meta = {
+        "model_name": model_name,
+        "hook_names": list(hook_names),
+        "fingerprint": fingerprint,
+        "categories": list(index["categories"]),
+        "shape": list(vectors.shape),
+    }
+    return atomic_save(entry_dir(model_name, hook_names, fingerprint, root), arrays, meta, tmp_path=tmp_path)
+
+
+def load_activations(model_name, hook_names, fingerprint, root=STORE_DIR):
+    """
+    Open a stored entry without copying it into memory.
+    Returns (vectors, index) where vectors is a read-only np.memmap
+    [n_rows, n_hooks, d_model], or None if the entry does not exist.
+    """
+    path = entry_dir(model_name, hook_names, fingerprint, root)
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+    index = {field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode="r") for field in INDEX_FIELDS}
+    index["categories"] = meta["categories"]
+    index["hook_names"] = meta["hook_names"]
+    return vectors, index
+
+
+def cached_activations(extract_fn, model_name, hook_names, fingerprint, root=STORE_DIR, stream=False):
+    """
+    Load (vectors, index) from the store, or call extract_fn() -> (vectors, index),
+    save the result and return the memory-mapped copy.
+    With stream, extract_fn(out_dir) writes vectors.npy into the entry's temporary
+    directory itself (e.g. extract_indexed_activations(..., out_dir=out_dir)), so the
+    vectors never have to fit in RAM.
+    """
+    stored = load_activations(model_name, hook_names, fingerprint, root)
+    if stored is not None:
+        print(f"Loaded activations from {entry_dir(model_name, hook_names, fingerprint, root)}")
+        return stored
+    if stream:
+        tmp_path = begin_entry(entry_dir(model_name, hook_names, fingerprint, root))
+        vectors, index = extract_fn(tmp_path)
+        save_activations(vectors, index, model_name, hook_names, fingerprint, root, tmp_path=tmp_path)
+    else:
+        vectors, index = extract_fn()
+        save_activations(vectors, index, model_name, hook_names, fingerprint, root)
+    return load_activations(model_name, hook_names, fingerprint, root)
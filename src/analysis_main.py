@@ -8,48 +8,34 @@ from transformer_lens import HookedTransformer
 import os
 import json
 
+from activation_extractor import word_activations
+from forward_cache import FORWARD_CACHE
+from token_cache import cached_tokenize
+from position_resolver import resolve_word_positions
+from logit_lens import logit_lens
+
+MODEL_NAME = "gpt2-small"
+
 # Ensure directories exist
 os.makedirs("results/figures", exist_ok=True)
 
 def load_model():
     print("Loading model...")
-    model = HookedTransformer.from_pretrained("gpt2-small")
+    model = HookedTransformer.from_pretrained(MODEL_NAME)
     model.eval()
     return model
 
-def get_vectors(model, prompts, token_of_interest):
+def get_vectors(model, prompts, tokens_of_interest):
     """
-    Get the residual stream vector at the specific token position.
+    Get the residual stream vectors at every occurrence of each token of interest.
+    Only the target rows of blocks.11.hook_resid_post are gathered (no full cache), all
+    tokens in one forward, and the result is kept in the activation store for the next run.
+    Returns dict token -> [n_occurrences, d_model].
     """
-    vectors = []
-    for prompt in prompts:
-        # We need to find the index of the token of interest
-        # This is a bit tricky with tokenization.
-        # We'll assume the token of interest is at the end or specific place.
-        # For this script, we'll design prompts so the token is last or we know the index.
-        
-        tokens = model.to_tokens(prompt)
-        str_tokens = model.to_str_tokens(prompt)
-        
-        # Find index. This is a heuristic.
-        idx = -1
-        found = False
-        for i, t in enumerate(str_tokens):
-            if token_of_interest.strip() in t: # partial match
-                idx = i
-                found = True
-        
-        if not found:
-            # Fallback for " machine" vs " machine" (space)
-            idx = -1 
-        
-        _, cache = model.run_with_cache(tokens)
-        # Get final residual stream (blocks.11.hook_resid_post)
-        # Shape: [batch, pos, d_model]
-        resid = cache["blocks.11.hook_resid_post"][0, idx, :].detach().cpu()
-        vectors.append(resid)
-        
-    return torch.stack(vectors)
+    vectors = word_activations(
+        model, prompts, tokens_of_interest, ["blocks.11.hook_resid_post"], MODEL_NAME, cache=FORWARD_CACHE
+    )
+    return {token: torch.tensor(v[:, 0]) for token, v in vectors.items()}
 
 def main():
     model = load_model()
@@ -92,19 +78,23 @@ def main():
     # 2. Extract Vectors
     print("Extracting vectors...")
     
+    # One forward over wm_prompts serves both of its tokens
+    v_wm = get_vectors(model, wm_prompts, [" machine", " washing"])
+    
     # Vector at " machine" in "washing machine" context
     # Ideally, this represents the full "washing machine" concept
-    v_wm_full = get_vectors(model, wm_prompts, " machine")
+    v_wm_full = v_wm[" machine"]
     
     # Vector at " washing" in "washing machine" context
     # This represents "washing" before "machine" is integrated
-    v_wm_part1 = get_vectors(model, wm_prompts, " washing")
+    v_wm_part1 = v_wm[" washing"]
     
     # Vector at " washing" in "washing only" context
-    v_w_only = get_vectors(model, w_prompts, " washing")
+    v_w_only = get_vectors(model, w_prompts, [" washing"])[" washing"]
     
     # Vector at " machine" in "machine only" context
-    v_m_only = get_vectors(model, m_prompts, " machine")
+    v_m_only = get_vectors(model, m_prompts, [" machine"])[" machine"]
+    print(f"Forward cache: {FORWARD_CACHE.stats()}")
     
     # Mean vectors
     mean_wm_full = v_wm_full.mean(dim=0)
@@ -131,43 +121,33 @@ def main():
     print("Similarities:", json.dumps(sims, indent=2))
     
     # 5. Logit Lens Analysis
-    # What does the model predict after " washing" in "washing machine" context?
+    # What does the model predict after " washing" in "washing machine" context, at every layer?
     print("\nLogit Lens Analysis...")
     logit_results = []
     
-    for prompt in wm_prompts:
-        tokens = model.to_tokens(prompt)
-        str_tokens = model.to_str_tokens(prompt)
-        
-        # Find index of " washing"
-        idx = -1
-        for i, t in enumerate(str_tokens):
-            if " washing" in t:
-                idx = i
-                break
-        
-        if idx == -1: continue
-            
-        # Get logits at this position
-        logits = model(tokens)[0, idx, :]
-        probs = torch.softmax(logits, dim=-1)
-        
-        # Top predictions
-        top_k = torch.topk(probs, k=5)
-        top_tokens = [model.to_string(t) for t in top_k.indices]
-        top_probs = top_k.values.tolist()
-        
-        # Rank of " machine"
-        machine_token_id = model.to_single_token(" machine")
-        machine_rank = (logits > logits[machine_token_id]).sum().item()
-        machine_prob = probs[machine_token_id].item()
-        
+    wm_seqs = cached_tokenize(model, wm_prompts)
+    # First " washing" of each prompt
+    first_washing = {}
+    for p_idx, pos in resolve_word_positions(model, wm_prompts, wm_seqs, " washing"):
+        first_washing.setdefault(p_idx, pos)
+    lens_targets = sorted(first_washing.items())
+    
+    # One forward gathers the " washing" rows of every layer; only those rows are unembedded
+    machine_token_id = model.to_single_token(" machine")
+    lens = logit_lens(model, wm_seqs, lens_targets, target_token_ids=machine_token_id, k=5, cache=FORWARD_CACHE)
+    
+    for t, (p_idx, _) in enumerate(lens_targets):
+        # Final layer: the model's actual prediction
         logit_results.append({
-            "prompt": prompt,
-            "top_tokens": top_tokens,
-            "top_probs": top_probs,
-            "machine_rank": machine_rank,
-            "machine_prob": machine_prob
+            "prompt": wm_prompts[p_idx],
+            "top_tokens": [model.to_string(int(i)) for i in lens["top_ids"][t, -1]],
+            "top_probs": lens["top_probs"][t, -1].tolist(),
+            "machine_rank": int(lens["target_rank"][t, -1]),
+            "machine_prob": float(lens["target_prob"][t, -1]),
+            # Same quantities per layer (logit lens)
+            "layer_top_tokens": [[model.to_string(int(i)) for i in ids] for ids in lens["top_ids"][t]],
+            "layer_machine_rank": lens["target_rank"][t].tolist(),
+            "layer_machine_prob": lens["target_prob"][t].tolist(),
         })
         
     # Save results
@@ -3,30 +3,41 @@ import torch
 import numpy as np
 import matplotlib.pyplot as plt
 from transformer_lens import HookedTransformer
-from sklearn.linear_model import LinearRegression
 import json
 import os
 
+from activation_extractor import gather_sequence_residuals, layer_hook_names, word_activations
+from forward_cache import FORWARD_CACHE
+from token_cache import cached_tokenize
+from decomposition import batched_lstsq, decompose, SOLVERS
+
+MODEL_NAME = "gpt2-small"
+
 def load_model():
-    model = HookedTransformer.from_pretrained("gpt2-small")
+    model = HookedTransformer.from_pretrained(MODEL_NAME)
     model.eval()
     return model
 
-def get_layer_vectors(model, prompts, token_of_interest):
-    all_resids = []
-    for prompt in prompts:
-        tokens = model.to_tokens(prompt)
-        str_tokens = model.to_str_tokens(prompt)
-        idx = -1
-        for i, t in enumerate(str_tokens):
-            if token_of_interest.strip() in t: idx = i
-        if idx == -1: continue
-        _, cache = model.run_with_cache(tokens)
-        prompt_resids = []
-        for L in range(model.cfg.n_layers):
-            prompt_resids.append(cache[f"blocks.{L}.hook_resid_post"][0, idx, :].detach().cpu())
-        all_resids.append(torch.stack(prompt_resids))
-    return torch.stack(all_resids).mean(dim=0)
+def get_layer_vectors(model, prompts, token_of_interest, max_layer=None):
+    # Only layers 0..max_layer are computed; the forward pass stops after max_layer
+    if max_layer is None:
+        max_layer = model.cfg.n_layers - 1
+    hook_names = layer_hook_names("hook_resid_post", max_layer)
+    # Hooks gather only the target rows: [n_occurrences, n_layers, d_model]
+    all_resids = word_activations(
+        model, prompts, [token_of_interest], hook_names, MODEL_NAME, cache=FORWARD_CACHE
+    )[token_of_interest]
+    return torch.from_numpy(all_resids.mean(axis=0))
+
+def get_mean_activation(model, prompts, max_layer=None):
+    """Mean residual over every non-BOS position of prompts, per layer: [layers, d_model]."""
+    if max_layer is None:
+        max_layer = model.cfg.n_layers - 1
+    token_seqs = cached_tokenize(model, prompts)
+    targets = [(p_idx, pos) for p_idx in range(len(prompts)) for pos in range(1, len(token_seqs[p_idx]))]
+    hook_names = layer_hook_names("hook_resid_post", max_layer)
+    vectors = gather_sequence_residuals(model, token_seqs, targets, hook_names, cache=FORWARD_CACHE)
+    return vectors.mean(dim=0)
 
 def main():
     model = load_model()
@@ -57,47 +68,37 @@ def main():
     vecs_wm = get_layer_vectors(model, wm_prompts, " machine")
     vecs_w = get_layer_vectors(model, w_prompts, " washing")
     vecs_m = get_layer_vectors(model, m_prompts, " machine")
+    print(f"Forward cache: {FORWARD_CACHE.stats()}")
     
     n_layers = vecs_wm.shape[0]
     
+    # Can the vector WM be formed by a linear combo of W and M? The d_model dimensions
+    # are the samples; every layer is solved in one batched least squares.
+    basis = np.stack([vecs_w.numpy(), vecs_m.numpy()], axis=-1) # [layers, d_model, 2]
+    fit = batched_lstsq(vecs_wm.numpy(), basis)
+    
     results = {
         "layers": list(range(n_layers)),
-        "alpha_w": [], # Coeff for Washing
-        "beta_m": [],  # Coeff for Machine
-        "r2": [],      # Explained Variance
-        "resid_ratio": []
+        "alpha_w": fit["coefs"][:, 0].tolist(), # Coeff for Washing
+        "beta_m": fit["coefs"][:, 1].tolist(),  # Coeff for Machine
+        "r2": fit["r2"].tolist(),               # Explained Variance
+        "resid_ratio": fit["resid_ratio"].tolist()
     }
     
-    for L in range(n_layers):
-        y = vecs_wm[L].numpy().reshape(1, -1) # Target: WM
-        X_w = vecs_w[L].numpy().reshape(1, -1)
-        X_m = vecs_m[L].numpy().reshape(1, -1)
-        
-        # We want to solve y = a*X_w + b*X_m
-        # But X is shape [1, d_model]. We have d_model equations? 
-        # No, we treat dimensions as samples? 
-        # Yes, we are asking: can the vector y be formed by linear combo of vectors X_w and X_m?
-        # So we transpose.
-        
-        target = y.T
-        features = np.concatenate([X_w.T, X_m.T], axis=1)
-        
-        reg = LinearRegression(fit_intercept=False).fit(features, target)
-        
-        alpha = reg.coef_[0][0]
-        beta = reg.coef_[0][1]
-        score = reg.score(features, target)
-        
-        # Residual
-        pred = reg.predict(features)
-        resid = target - pred
-        resid_norm = np.linalg.norm(resid)
-        target_norm = np.linalg.norm(target)
-        
-        results["alpha_w"].append(float(alpha))
-        results["beta_m"].append(float(beta))
-        results["r2"].append(float(score))
-        results["resid_ratio"].append(float(resid_norm / target_norm))
+    # WM ≈ a*W + b*M + c*bias, with bias the mean activation over all prompt tokens,
+    # under each solver (all layers batched)
+    vecs_bias = get_mean_activation(model, wm_prompts + w_prompts + m_prompts)
+    basis_k = np.stack([vecs_w.numpy(), vecs_m.numpy(), vecs_bias.numpy()], axis=-1) # [layers, d_model, 3]
+    results["k_component"] = {}
+    for solver in SOLVERS:
+        fit_k = decompose(vecs_wm.numpy(), basis_k, solver=solver, names=["washing", "machine", "bias"])
+        results["k_component"][solver] = {
+            "names": fit_k["names"],
+            "coefs": fit_k["coefs"].tolist(),
+            "contribution": fit_k["contribution"].tolist(),
+            "r2": fit_k["r2"].tolist(),
+            "resid_ratio": fit_k["resid_ratio"].tolist()
+        }
         
     with open("results/orthogonal_results.json", "w") as f:
         json.dump(results, f, indent=2)
@@ -6,48 +6,41 @@ from transformer_lens import HookedTransformer
 import json
 import os
 
+from activation_extractor import layer_hook_names, word_activations
+from forward_cache import FORWARD_CACHE
+from bootstrap import bootstrap_compound_metrics
+
+MODEL_NAME = "gpt2-small"
+
+# Bootstrap replicates behind the confidence bands (see bootstrap.py)
+BOOTSTRAP_REPLICATES = 2000
+
 def load_model():
-    model = HookedTransformer.from_pretrained("gpt2-small")
+    model = HookedTransformer.from_pretrained(MODEL_NAME)
     model.eval()
     return model
 
-def get_layer_vectors(model, prompts, token_of_interest):
+def get_layer_vectors(model, prompts, token_of_interest, max_layer=None, reduce=True):
     """
     Get residual stream vectors for ALL layers at specific token position.
-    Returns: [layers, d_model] (averaged over prompts)
+    With max_layer set, only layers 0..max_layer are computed (the forward pass stops there).
+    Returns: [layers, d_model] (averaged over prompts), or with reduce=False the
+    per-occurrence stack [n_occurrences, layers, d_model] as a numpy array
     """
-    layer_vectors = []
-    
-    # We'll batch this properly or just loop
-    # For simplicity and small data, loop is fine
+    if max_layer is None:
+        max_layer = model.cfg.n_layers - 1
     
-    all_resids = [] # [prompt, layer, d_model]
-    
-    for prompt in prompts:
-        tokens = model.to_tokens(prompt)
-        str_tokens = model.to_str_tokens(prompt)
-        
-        idx = -1
-        for i, t in enumerate(str_tokens):
-            if token_of_interest.strip() in t:
-                idx = i
-        
-        if idx == -1: continue # Skip if not found
-        
-        _, cache = model.run_with_cache(tokens)
-        
-        prompt_resids = []
-        for L in range(model.cfg.n_layers):
-            # hook_resid_post: output of the block
-            resid = cache[f"blocks.{L}.hook_resid_post"][0, idx, :].detach().cpu()
-            prompt_resids.append(resid)
-        
-        all_resids.append(torch.stack(prompt_resids))
-        
-    # Stack: [n_prompts, n_layers, d_model]
-    stack = torch.stack(all_resids)
-    # Mean over prompts: [n_layers, d_model]
-    return stack.mean(dim=0)
+    # One batched forward gathers only the target rows from each
+    # blocks.{L}.hook_resid_post (hook_resid_post: output of the block)
+    hook_names = layer_hook_names("hook_resid_post", max_layer)
+    stack = word_activations(
+        model, prompts, [token_of_interest], hook_names, MODEL_NAME, cache=FORWARD_CACHE
+    )[token_of_interest]
+    # Stack: [n_occurrences, n_layers, d_model]
+    if not reduce:
+        return stack
+    # Mean over occurrences: [n_layers, d_model]
+    return torch.from_numpy(stack.mean(axis=0))
 
 def main():
     model = load_model()
@@ -75,10 +68,21 @@ def main():
     ]
     
     print("Extracting vectors...")
+    # [n_occurrences, layers, d_model]
+    stack_wm = get_layer_vectors(model, wm_prompts, " machine", reduce=False)
+    stack_w = get_layer_vectors(model, w_prompts, " washing", reduce=False) # Comparing to 'washing' concept
+    stack_m = get_layer_vectors(model, m_prompts, " machine", reduce=False) # Comparing to 'machine' concept
+    print(f"Forward cache: {FORWARD_CACHE.stats()}")
+    
     # [layers, d_model]
-    vecs_wm = get_layer_vectors(model, wm_prompts, " machine")
-    vecs_w = get_layer_vectors(model, w_prompts, " washing") # Comparing to 'washing' concept
-    vecs_m = get_layer_vectors(model, m_prompts, " machine") # Comparing to 'machine' concept
+    vecs_wm = torch.from_numpy(stack_wm.mean(axis=0))
+    vecs_w = torch.from_numpy(stack_w.mean(axis=0))
+    vecs_m = torch.from_numpy(stack_m.mean(axis=0))
+    
+    # Resampling the prompts of each group: every replicate and layer in one batch
+    intervals = bootstrap_compound_metrics(stack_wm, stack_w, stack_m, n_boot=BOOTSTRAP_REPLICATES)
+    ci_wm_m = intervals["sim_wm_m_centered"]
+    ci_wm_w = intervals["sim_wm_w_centered"]
     
     n_layers = vecs_wm.shape[0]
     
@@ -123,7 +127,11 @@ def main():
         "layers": list(range(n_layers)),
         "sim_wm_m": sims_wm_m,
         "sim_wm_w": sims_wm_w,
-        "sim_wm_sum": sims_wm_sum
+        "sim_wm_sum": sims_wm_sum,
+        # 95% percentile bootstrap intervals per layer
+        "sim_wm_m_ci": [ci_wm_m["low"], ci_wm_m["high"]],
+        "sim_wm_w_ci": [ci_wm_w["low"], ci_wm_w["high"]],
+        "intervals": intervals
     }
     
     with open("results/refined_results.json", "w") as f:
@@ -131,8 +139,10 @@ def main():
         
     # Plot
     plt.figure(figsize=(10, 6))
-    plt.plot(results["layers"], sims_wm_m, label="Sim(WM, Machine)", marker='o')
-    plt.plot(results["layers"], sims_wm_w, label="Sim(WM, Washing)", marker='s')
+    line_m, = plt.plot(results["layers"], sims_wm_m, label="Sim(WM, Machine)", marker='o')
+    line_w, = plt.plot(results["layers"], sims_wm_w, label="Sim(WM, Washing)", marker='s')
+    plt.fill_between(results["layers"], ci_wm_m["low"], ci_wm_m["high"], color=line_m.get_color(), alpha=0.2)
+    plt.fill_between(results["layers"], ci_wm_w["low"], ci_wm_w["high"], color=line_w.get_color(), alpha=0.2)
     plt.plot(results["layers"], sims_wm_sum, label="Sim(WM, Washing+Machine)", marker='^', linestyle='--')
     
     plt.title("Layer-wise Centered Cosine Similarity")
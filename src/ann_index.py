@@ -0,0 +1,198 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from activation_store import STORE_DIR, entry_dir, begin_entry, atomic_save
+from similarity import normalize_rows, cosine_search
+
+ANN_ARRAYS = ["centroids", "list_offsets", "list_ids", "list_vectors"]
+
+
+def _layer(vectors, hook):
+    return vectors[:, hook] if np.ndim(vectors) == 3 else vectors
+
+
+def default_n_lists(n_rows):
+    """About 4 sqrt(n) inverted lists, the usual IVF sizing."""
+    return max(1, min(n_rows, int(4 * np.sqrt(n_rows))))
+
+
+def assign_lists(layer, centroids, chunk_rows=65536):
+    """Nearest centroid (by cosine) of every row of layer [n, d_model], chunk_rows at a time."""
+    assignment = np.empty(len(layer), dtype=np.int64)
+    for start in range(0, len(layer), chunk_rows):
+        unit = normalize_rows(layer[start:start + chunk_rows])
+        assignment[start:start + len(unit)] = np.argmax(unit @ centroids.T, axis=1)
+    return assignment
+
+
+def train_centroids(layer, n_lists, n_iter=10, sample_size=None, seed=0):
+    """
+    Spherical k-means centroids [n_lists, d_model] from a random sample of rows
+    (32 per list by default). Empty lists are re-seeded from random sample rows.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(layer)
+    sample_size = min(n, sample_size or 32 * n_lists)
+    # Sorted row ids keep reads from a memory-mapped store sequential
+    sample = normalize_rows(layer[np.sort(rng.choice(n, sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+    for _ in range(n_iter):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        counts = np.bincount(assignment, minlength=n_lists)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        empty = counts == 0
+        sums[~empty] = np.add.reduceat(sample[np.argsort(assignment, kind="stable")], starts[~empty])
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def build_ann_index(vectors, hook=0, n_lists=None, n_iter=10, sample_size=None, seed=0, chunk_rows=65536,
+                    out_dir=None):
+    """
+    IVF index over one hook (layer) of vectors [n, n_hooks, d_model] or [n, d_model].
+
+    Rows are assigned to their nearest k-means centroid; the unit rows are stored
+    grouped by list (CSR: list_offsets into list_ids / list_vectors), so a search
+    scans a few contiguous slices instead of the whole layer.
+    out_dir: write list_vectors straight to out_dir/list_vectors.npy through a
+    memmap, chunk_rows at a time, instead of holding the normalised layer in memory.
+    Returns dict of arrays (see ANN_ARRAYS) plus "n_rows".
+    """
+    layer = _layer(vectors, hook)
+    n = len(layer)
+    n_lists = n_lists or default_n_lists(n)
+    centroids = train_centroids(layer, n_lists, n_iter, sample_size, seed)
+    assignment = assign_lists(layer, centroids, chunk_rows)
+
+    order = np.argsort(assignment, kind="stable")
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))]).astype(np.int64)
+    if out_dir is not None:
+        list_vectors = np.lib.format.open_memmap(
+            os.path.join(out_dir, "list_vectors.npy"), mode="w+", dtype=np.float32, shape=(n, layer.shape[-1])
+        )
+    else:
+        list_vectors = np.empty((n, layer.shape[-1]), dtype=np.float32)
+    for start in range(0, n, chunk_rows):
+        rows = order[start:start + chunk_rows]
+        # Fancy indexing a memmap reads sorted rows faster
+        sort = np.argsort(rows)
+        unit = np.empty((len(rows), layer.shape[-1]), dtype=np.float32)
+        unit[sort] = normalize_rows(layer[rows[sort]])
+        list_vectors[start:start + len(rows)] = unit
+    if out_dir is not None:
+        list_vectors.flush()
+    return {
+        "centroids": centroids,
+        "list_offsets": list_offsets,
+        "list_ids": order.astype(np.int64),
+        "list_vectors": list_vectors,
+        "n_rows": n,
+    }
+
+
+def ann_search(index, queries, k=10, n_probe=8):
+    """
+    Approximate top-k by cosine for queries [n_queries, d_model]: only the n_probe
+    lists whose centroids are closest to each query are scanned.
+    Returns (ids [n_queries, k], sims [n_queries, k]), most similar first; slots
+    beyond the number of scanned rows are -1 / -inf.
+    """
+    queries = normalize_rows(np.atleast_2d(queries))
+    centroids = np.asarray(index["centroids"])
+    offsets = index["list_offsets"]
+    n_probe = min(n_probe, len(centroids))
+    coarse = queries @ centroids.T
+    probes = np.argpartition(-coarse, n_probe - 1, axis=1)[:, :n_probe]
+
+    ids = np.full((len(queries), k), -1, dtype=np.int64)
+    sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    for q, query in enumerate(queries):
+        ranges = [(offsets[p], offsets[p + 1]) for p in probes[q] if offsets[p + 1] > offsets[p]]
+        if not ranges:
+            continue
+        candidates = np.concatenate([np.asarray(index["list_vectors"][a:b]) for a, b in ranges])
+        candidate_ids = np.concatenate([np.asarray(index["list_ids"][a:b]) for a, b in ranges])
+        scores = candidates @ query
+        top = min(k, len(scores))
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        ids[q, :top] = candidate_ids[best]
+        sims[q, :top] = scores[best]
+    return ids, sims
+
+
+def recall_at_k(approx_ids, exact_ids):
+    """Mean fraction of each query's exact top-k found by the approximate search."""
+    hits = [len(np.intersect1d(a[a >= 0], e)) / max(len(e), 1) for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits)) if hits else float("nan")
+
+
+def evaluate_ann(vectors, index, hook=0, k=10, n_probes=(1, 2, 4, 8, 16, 32), n_queries=200, seed=0):
+    """
+    Recall@k against the exact blocked search (similarity.cosine_search) and query
+    latency, for random rows of the layer used as queries. Returns one row per n_probe.
+    """
+    layer = _layer(vectors, hook)
+    rng = np.random.default_rng(seed)
+    query_ids = np.sort(rng.choice(len(layer), min(n_queries, len(layer)), replace=False))
+    queries = np.asarray(layer[query_ids])
+    exact_ids, _ = cosine_search(vectors, queries, k, hook)
+
+    rows = []
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        approx_ids, _ = ann_search(index, queries, k, n_probe)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "n_probe": n_probe,
+            "recall": recall_at_k(approx_ids, exact_ids),
+            "ms_per_query": 1000 * elapsed / max(len(queries), 1),
+        })
+    return rows
+
+
+def ann_dir(model_name, hook_names, fingerprint, hook, n_lists, seed=0, root=STORE_DIR):
+    """An index lives inside the activation store entry it was built from."""
+    return os.path.join(entry_dir(model_name, hook_names, fingerprint, root), "ann", f"hook{hook}-{n_lists}-{seed}")
+
+
+def save_ann_index(index, path):
+    """Write the index arrays as .npy files plus meta.json (see activation_store.atomic_save)."""
+    meta = {"n_rows": index["n_rows"], "n_lists": len(index["centroids"])}
+    return atomic_save(path, {name: index[name] for name in ANN_ARRAYS}, meta)
+
+
+def load_ann_index(path):
+    """Memory-mapped index, or None if it was never built."""
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    index = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ANN_ARRAYS}
+    index["n_rows"] = meta["n_rows"]
+    return index
+
+
+def cached_ann_index(vectors, model_name, hook_names, fingerprint, hook=0, n_lists=None, seed=0, root=STORE_DIR,
+                     **build_kwargs):
+    """Load the index of one layer of a stored activation entry, or build and save it."""
+    n_lists = n_lists or default_n_lists(len(vectors))
+    path = ann_dir(model_name, hook_names, fingerprint, hook, n_lists, seed, root)
+    index = load_ann_index(path)
+    if index is not None:
+        return index
+    # list_vectors goes straight into the entry's temporary directory
+    tmp_path = begin_entry(path)
+    index = build_ann_index(vectors, hook, n_lists, seed=seed, out_dir=tmp_path, **build_kwargs)
+    arrays = {name: index[name] for name in ANN_ARRAYS if name != "list_vectors"}
+    meta = {"n_rows": index["n_rows"], "n_lists": len(index["centroids"])}
+    # Close the memmap before the directory is renamed
+    del index
+    atomic_save(path, arrays, meta, tmp_path=tmp_path)
+    return load_ann_index(path)
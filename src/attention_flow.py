@@ -0,0 +1,112 @@
+import numpy as np
+import torch
+
+from activation_extractor import (
+    length_bucketed_batches, model_pad_token_id, pad_batch, layer_hook_names, stop_layer_for_hooks,
+)
+
+
+def extract_attention_flow(model, token_seqs, targets, key_positions=None, directions=None, layers=None,
+                           batch_size=32, max_tokens=None):
+    """
+    Per-head attention and head outputs at target query positions, one forward per
+    length-bucketed batch.
+
+    targets: list of (seq_idx, pos) query positions (e.g. every " machine").
+    Hooks on blocks.{L}.attn.hook_pattern keep only the query row at each target,
+    [n_heads, seq], or with key_positions (one key position per target, e.g. the
+    modifier at pos - 1) only the single weight pattern[q, k]; the [heads, seq, seq]
+    pattern of a layer is dropped as soon as its hook has fired. Hooks on hook_z keep
+    each head's z at the target, and with directions (dict name -> [d_model], e.g. the
+    " washing" and " machine" embeddings) the head outputs z_h W_O[h] are projected onto
+    them. The forward stops after the deepest requested layer.
+
+    Returns dict:
+      layers           list of layer numbers
+      pattern          [n_targets, n_layers, n_heads, max_pos + 1] query rows (0 past
+                       each query, as under causal masking), or [n_targets, n_layers,
+                       n_heads] with key_positions
+      head_norm        [n_targets, n_layers, n_heads] ||z_h W_O[h]||
+      direction_names  list, and
+      projection       [n_targets, n_layers, n_heads, n_directions] <z_h W_O[h], unit direction>
+                       (with directions)
+    """
+    layers = list(range(model.cfg.n_layers)) if layers is None else sorted(layers)
+    pattern_hooks = [layer_hook_names("attn.hook_pattern", L, L)[0] for L in layers]
+    z_hooks = [layer_hook_names("attn.hook_z", L, L)[0] for L in layers]
+    n_heads = model.cfg.n_heads
+    device = model.cfg.device
+
+    targets = [(s, pos if pos >= 0 else pos + len(token_seqs[s])) for s, pos in targets]
+    n = len(targets)
+    max_pos = max((pos for _, pos in targets), default=0)
+    if key_positions is not None:
+        key_positions = [k if k >= 0 else k + len(token_seqs[s]) for (s, _), k in zip(targets, key_positions)]
+        pattern = np.zeros((n, len(layers), n_heads), dtype=np.float32)
+    else:
+        pattern = np.zeros((n, len(layers), n_heads, max_pos + 1), dtype=np.float32)
+    head_norm = np.zeros((n, len(layers), n_heads), dtype=np.float32)
+
+    direction_names = list(directions.keys()) if directions is not None else []
+    if directions is not None:
+        units = torch.stack([torch.as_tensor(np.asarray(directions[name]), dtype=model.cfg.dtype)
+                             for name in direction_names]).to(device)
+        units = units / units.norm(dim=-1, keepdim=True)
+        # Projection of each head's output onto the directions, folded into W_O: [n_layers, heads, d_head, n_dirs]
+        with torch.no_grad():
+            W_O_dirs = torch.stack([model.W_O[L] @ units.T for L in layers])
+        projection = np.zeros((n, len(layers), n_heads, len(direction_names)), dtype=np.float32)
+
+    by_seq = {}
+    for t, (seq_idx, pos) in enumerate(targets):
+        by_seq.setdefault(seq_idx, []).append(t)
+    seq_ids = list(by_seq.keys())
+    lengths = [len(token_seqs[s]) for s in seq_ids]
+    pad_token_id = model_pad_token_id(model)
+    stop_at_layer = stop_layer_for_hooks(pattern_hooks + z_hooks)
+
+    for batch in length_bucketed_batches(lengths, batch_size=batch_size, max_tokens=max_tokens):
+        batch_seqs = [seq_ids[b] for b in batch]
+        tokens, attention_mask = pad_batch([token_seqs[s] for s in batch_seqs], pad_token_id)
+        rows = [t for seq_idx in batch_seqs for t in by_seq[seq_idx]]
+        batch_idx = torch.tensor([row for row, seq_idx in enumerate(batch_seqs) for _ in by_seq[seq_idx]],
+                                 device=device)
+        positions = torch.tensor([targets[t][1] for t in rows], device=device)
+        keys = torch.tensor([key_positions[t] for t in rows], device=device) if key_positions is not None else None
+
+        def make_pattern_hook(j):
+            def pattern_hook(act, hook):
+                # act: [batch, head, query, key]
+                if keys is not None:
+                    pattern[rows, j] = act[batch_idx, :, positions, keys].float().cpu().numpy()
+                else:
+                    query_rows = act[batch_idx, :, positions, :max_pos + 1].float().cpu().numpy()
+                    pattern[rows, j, :, :query_rows.shape[-1]] = query_rows
+            return pattern_hook
+
+        def make_z_hook(j):
+            def z_hook(act, hook):
+                # act: [batch, pos, head, d_head] -> [n_rows, head, d_head]
+                z = act[batch_idx, positions]
+                L = layers[j]
+                head_out = torch.einsum("nhd,hdm->nhm", z, model.W_O[L])
+                head_norm[rows, j] = head_out.norm(dim=-1).float().cpu().numpy()
+                if directions is not None:
+                    projection[rows, j] = torch.einsum("nhd,hdk->nhk", z, W_O_dirs[j]).float().cpu().numpy()
+            return z_hook
+
+        fwd_hooks = [(name, make_pattern_hook(j)) for j, name in enumerate(pattern_hooks)]
+        fwd_hooks += [(name, make_z_hook(j)) for j, name in enumerate(z_hooks)]
+        with torch.no_grad():
+            model.run_with_hooks(
+                tokens.to(device),
+                attention_mask=attention_mask.to(device),
+                return_type=None,
+                stop_at_layer=stop_at_layer,
+                fwd_hooks=fwd_hooks,
+            )
+
+    out = {"layers": layers, "pattern": pattern, "head_norm": head_norm, "direction_names": direction_names}
+    if directions is not None:
+        out["projection"] = projection
+    return out
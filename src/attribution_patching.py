@@ -0,0 +1,162 @@
+import numpy as np
+import torch
+
+from activation_extractor import layer_hook_names
+from activation_patching import (
+    FINAL_HOOK, per_pair_ids, answer_metric, run_metric, pair_batch, align_to_end, store_hooks, patch_sites,
+)
+
+# Residual stream per position, and attention heads per position (hook_z: [batch, pos, head, d_head])
+HOOK_POINTS = ["hook_resid_pre", "attn.hook_z"]
+
+
+def attribution_patching(model, clean_seqs, corrupt_seqs, answer_ids, wrong_ids=None, hook_points=HOOK_POINTS,
+                         layers=None, verify_top_k=0, max_rows=1024):
+    """
+    Linear estimate of every site's activation patching effect (see
+    activation_patching.activation_patching) from one clean forward, one corrupted
+    forward and one backward pass, batched over all pairs:
+
+        effect(site) ≈ (clean_act - corrupt_act) · d metric / d act |corrupt
+
+    summed over the site's last dimension (d_model, or d_head per head for attn.hook_z).
+    The metric is read from the ln_final row at the last token (answer_metric), and the
+    backward pass only differentiates with respect to the hooked activations.
+
+    With verify_top_k, the k sites with the largest mean |estimate| are re-measured
+    with exact patching (see verify_top_sites).
+    Returns dict:
+      layers     list of layer numbers
+      clean      [n_pairs], corrupt [n_pairs]
+      estimates  dict hook_point -> [n_pairs, n_layers, max_len] (nan past a pair's
+                 length), with a trailing [n_heads] dimension for per-head hooks
+      verified   (with verify_top_k) list of site dicts, see verify_top_sites
+    """
+    layers = list(range(model.cfg.n_layers)) if layers is None else sorted(layers)
+    hook_names = {point: [layer_hook_names(point, L, L)[0] for L in layers] for point in hook_points}
+    all_names = [name for names in hook_names.values() for name in names]
+    n_pairs = len(clean_seqs)
+    answer_ids = per_pair_ids(answer_ids, n_pairs)
+    wrong_ids = per_pair_ids(wrong_ids, n_pairs)
+    clean_tokens, corrupt_tokens, attention_mask, last_pos = pair_batch(model, clean_seqs, corrupt_seqs)
+    max_len = clean_tokens.shape[1]
+
+    clean_acts = {}
+    clean = run_metric(
+        model, clean_tokens, attention_mask, last_pos, answer_ids, wrong_ids, store_hooks(clean_acts, all_names)
+    ).cpu().numpy()
+
+    # Corrupted run with the graph kept; the hooks hold on to the activations themselves
+    corrupt_acts = {}
+    final = {}
+
+    def keep_hook(act, hook):
+        corrupt_acts[hook.name] = act
+
+    def final_hook(act, hook):
+        final["normed"] = act[torch.arange(len(act), device=act.device), last_pos]
+
+    with torch.enable_grad():
+        model.run_with_hooks(
+            corrupt_tokens,
+            attention_mask=attention_mask,
+            return_type=None,
+            fwd_hooks=[(name, keep_hook) for name in all_names] + [(FINAL_HOOK, final_hook)],
+        )
+        corrupt_metric = answer_metric(model, final["normed"], answer_ids, wrong_ids)
+        # Pairs are independent rows, so the gradient of the sum is each pair's own gradient
+        grads = torch.autograd.grad(corrupt_metric.sum(), [corrupt_acts[name] for name in all_names])
+    grads = dict(zip(all_names, grads))
+
+    lengths = np.array([len(s) for s in clean_seqs])
+    padding = np.arange(max_len)[None, :] >= lengths[:, None]
+    estimates = {}
+    with torch.no_grad():
+        for point, names in hook_names.items():
+            per_layer = [
+                ((clean_acts[name] - corrupt_acts[name].detach()) * grads[name]).sum(-1).cpu().numpy()
+                for name in names
+            ]
+            # [n_pairs, n_layers, max_len(, n_heads)]
+            estimate = np.stack(per_layer, axis=1).astype(np.float32)
+            estimate[padding[:, None, :].repeat(len(names), axis=1)] = np.nan
+            estimates[point] = estimate
+
+    out = {
+        "layers": layers,
+        "clean": clean,
+        "corrupt": corrupt_metric.detach().cpu().numpy(),
+        "estimates": estimates,
+    }
+    if verify_top_k:
+        out["verified"] = verify_top_sites(
+            model, clean_seqs, corrupt_seqs, answer_ids, out, wrong_ids, k=verify_top_k, max_rows=max_rows
+        )
+    return out
+
+
+def verify_top_sites(model, clean_seqs, corrupt_seqs, answer_ids, attribution, wrong_ids=None, k=20,
+                     max_rows=1024):
+    """
+    Exact patching of the k sites with the largest mean |estimate| across all hook
+    points of an attribution_patching result, over every pair long enough to have the
+    site (one batched sweep, see activation_patching.patch_sites).
+    Sites are positions counted from the end of each pair (align_to_end), so a site is
+    the same token slot (e.g. the modifier at -1) in prompts of different lengths.
+    Returns a list of dicts (hook_point, layer, offset, head or None, estimate,
+    exact), largest |estimate| first; offset -1 is the last token, and estimate and
+    exact are means over pairs of the change in the metric.
+    """
+    n_pairs = len(clean_seqs)
+    answer_ids = per_pair_ids(answer_ids, n_pairs)
+    wrong_ids = per_pair_ids(wrong_ids, n_pairs)
+    layers = attribution["layers"]
+    lengths = [len(s) for s in clean_seqs]
+
+    # index: (layer column, aligned position column[, head]); offset = column - max_len
+    candidates = []
+    for point, estimate in attribution["estimates"].items():
+        mean = np.nanmean(align_to_end(estimate, lengths), axis=0)
+        for index in zip(*np.nonzero(np.isfinite(mean))):
+            candidates.append((abs(float(mean[index])), point, index, float(mean[index])))
+    candidates.sort(key=lambda c: -c[0])
+    top = candidates[:k]
+    max_len = max(lengths)
+    offsets = [int(index[1]) - max_len for _, _, index, _ in top]
+
+    hook_names = sorted({layer_hook_names(point, layers[index[0]], layers[index[0]])[0] for _, point, index, _ in top})
+    clean_tokens, corrupt_tokens, attention_mask, last_pos = pair_batch(model, clean_seqs, corrupt_seqs)
+    clean_acts = {}
+    run_metric(model, clean_tokens, attention_mask, last_pos, answer_ids, wrong_ids, store_hooks(clean_acts, hook_names))
+    corrupt = run_metric(model, corrupt_tokens, attention_mask, last_pos, answer_ids, wrong_ids).cpu().numpy()
+
+    # Per-head and per-position sites cannot share a patching hook, so run them separately
+    sites = []
+    for per_head in (False, True):
+        rows = [(s, p) for s, (_, point, index, _) in enumerate(top) for p in range(n_pairs)
+                if (len(index) == 3) == per_head and lengths[p] + offsets[s] >= 0]
+        if not rows:
+            continue
+        site_ids, site_pair = zip(*rows)
+        names = [layer_hook_names(top[s][1], layers[top[s][2][0]], layers[top[s][2][0]])[0] for s in site_ids]
+        metric = patch_sites(
+            model, corrupt_tokens, attention_mask, last_pos, answer_ids, wrong_ids, clean_acts, hook_names,
+            site_pair, [hook_names.index(name) for name in names], [lengths[p] + offsets[s] for s, p in rows],
+            [top[s][2][2] for s in site_ids] if per_head else None, max_rows=max_rows,
+        )
+        sites.extend(zip(site_ids, site_pair, metric))
+
+    effects = {}
+    for s, p, metric in sites:
+        effects.setdefault(s, []).append(metric - corrupt[p])
+    verified = []
+    for s, (_, point, index, estimate) in enumerate(top):
+        verified.append({
+            "hook_point": point,
+            "layer": layers[index[0]],
+            "offset": offsets[s],
+            "head": int(index[2]) if len(index) == 3 else None,
+            "estimate": estimate,
+            "exact": float(np.mean(effects[s])) if s in effects else None,
+        })
+    return verified
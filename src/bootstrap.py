@@ -0,0 +1,119 @@
+import numpy as np
+
+from decomposition import batched_lstsq
+
+
+def resample_counts(n, n_boot, rng):
+    """
+    Bootstrap resamples of n occurrence indices as a counts matrix [n_boot, n]:
+    counts[b, i] = how often occurrence i was drawn in replicate b.
+    A replicate mean is then counts @ X / n, one matmul for all replicates.
+    """
+    draws = rng.integers(0, n, size=(n_boot, n))
+    flat = (draws + n * np.arange(n_boot)[:, None]).ravel()
+    return np.bincount(flat, minlength=n_boot * n).reshape(n_boot, n)
+
+
+def bootstrap_means(acts, n_boot=2000, rng=None, chunk=512):
+    """
+    Means of n_boot bootstrap resamples of acts [n, ...] -> [n_boot, ...].
+    Replicates are computed chunk at a time, so memory is O(chunk x n).
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    acts = np.asarray(acts, dtype=np.float64)
+    n = len(acts)
+    flat = acts.reshape(n, -1)
+    out = np.empty((n_boot, flat.shape[1]))
+    for start in range(0, n_boot, chunk):
+        counts = resample_counts(n, min(chunk, n_boot - start), rng)
+        out[start:start + len(counts)] = counts @ flat / n
+    return out.reshape((n_boot,) + acts.shape[1:])
+
+
+def batched_cosine(a, b):
+    """Cosine along the last axis, broadcasting over everything else."""
+    return (a * b).sum(axis=-1) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1))
+
+
+def compound_statistics(mean_wm, mean_w, mean_m):
+    """
+    The compositionality metrics for batches of group means (each [..., d_model]):
+    raw and centered cosines (center = mean of the three groups, as in analysis_refined.py),
+    cos(WM - M, W) and the decomposition WM ≈ alpha * W + beta * M.
+    Returns dict name -> [...].
+    """
+    center = (mean_wm + mean_w + mean_m) / 3
+    # (cos(c_wm, c_w + c_m) is always -1 with this center, so it is not reported)
+    c_wm, c_w, c_m = mean_wm - center, mean_w - center, mean_m - center
+    fit = batched_lstsq(mean_wm, np.stack([mean_w, mean_m], axis=-1))
+    return {
+        "sim_wm_m": batched_cosine(mean_wm, mean_m),
+        "sim_diff_vs_w": batched_cosine(mean_wm - mean_m, mean_w),
+        "sim_wm_m_centered": batched_cosine(c_wm, c_m),
+        "sim_wm_w_centered": batched_cosine(c_wm, c_w),
+        "alpha_w": fit["coefs"][..., 0],
+        "beta_m": fit["coefs"][..., 1],
+        "r2": fit["r2"],
+    }
+
+
+def bootstrap_compound_metrics(acts_wm, acts_w, acts_m, n_boot=2000, ci=0.95, seed=0, chunk=512):
+    """
+    Percentile bootstrap CIs for compound_statistics.
+
+    acts_*: per-occurrence activations [n_occurrences, d_model] or [n_occurrences,
+    n_layers, d_model]; each group is resampled independently. All replicates and
+    layers are evaluated as one batch.
+    Returns dict metric -> {"estimate", "low", "high", "std"}, each a float or a
+    per-layer list.
+    """
+    rng = np.random.default_rng(seed)
+    groups = [np.asarray(a, dtype=np.float64) for a in (acts_wm, acts_w, acts_m)]
+    point = compound_statistics(*(a.mean(axis=0) for a in groups))
+
+    replicates = {}
+    for start in range(0, n_boot, chunk):
+        size = min(chunk, n_boot - start)
+        stats = compound_statistics(*(bootstrap_means(a, size, rng, chunk) for a in groups))
+        for name, values in stats.items():
+            replicates.setdefault(name, []).append(values)
+    replicates = {name: np.concatenate(values) for name, values in replicates.items()}
+
+    tail = (1 - ci) / 2 * 100
+    intervals = {}
+    for name, values in replicates.items():
+        low, high = np.nanpercentile(values, [tail, 100 - tail], axis=0)
+        intervals[name] = {
+            "estimate": point[name].tolist(),
+            "low": low.tolist(),
+            "high": high.tolist(),
+            "std": np.nanstd(values, axis=0).tolist(),
+        }
+    return intervals
+
+
+def permutation_test(acts_a, acts_b, n_perm=2000, seed=0, chunk=512):
+    """
+    Label-permutation test for "groups a and b have the same mean", per layer.
+    Statistic: ||mean_a - mean_b||. Each permutation is a random split of the pooled
+    occurrences, applied as a [n_perm, n_a + n_b] weight matrix, so all permutations
+    are a few matmuls. Returns (observed [...], p_value [...]).
+    """
+    rng = np.random.default_rng(seed)
+    acts_a = np.asarray(acts_a, dtype=np.float64)
+    acts_b = np.asarray(acts_b, dtype=np.float64)
+    n_a, n_b = len(acts_a), len(acts_b)
+    pooled = np.concatenate([acts_a, acts_b])
+    flat = pooled.reshape(n_a + n_b, -1)
+    trailing = pooled.shape[1:]
+
+    observed = np.linalg.norm(acts_a.mean(axis=0) - acts_b.mean(axis=0), axis=-1)
+    exceed = np.zeros(observed.shape)
+    for start in range(0, n_perm, chunk):
+        size = min(chunk, n_perm - start)
+        # Random permutation per row; the first n_a go to group a
+        in_a = np.argsort(rng.random((size, n_a + n_b)), axis=1) < n_a
+        weights = np.where(in_a, 1.0 / n_a, -1.0 / n_b)
+        diffs = (weights @ flat).reshape((size,) + trailing)
+        exceed += (np.linalg.norm(diffs, axis=-1) >= observed).sum(axis=0)
+    return observed, (exceed + 1) / (n_perm + 1)
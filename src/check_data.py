@@ -3,6 +3,8 @@ import datasets
 from datasets import load_from_disk
 import os
 
+from keyword_matcher import KeywordMatcher
+
 def check_data():
     dataset_path = "datasets/washing_machine_corpus"
     if not os.path.exists(dataset_path):
@@ -31,15 +33,22 @@ def check_data():
     w_examples = []
     m_examples = []
 
+    # One automaton pass per document gives every keyword hit and its offset
+    matcher = KeywordMatcher(["washing machine", "washing", "machine"])
+    doc_hits = []
+
     for item in data_list:
         text = item['text'].lower()
-        if "washing machine" in text:
+        hits = matcher.find_all(text)
+        doc_hits.append((text, hits))
+        found = {keyword for _, keyword in hits}
+        if "washing machine" in found:
             wm_count += 1
             if len(wm_examples) < 3: wm_examples.append(text)
-        elif "washing" in text:
+        elif "washing" in found:
             w_count += 1
             if len(w_examples) < 3: w_examples.append(text)
-        elif "machine" in text:
+        elif "machine" in found:
             m_count += 1
             if len(m_examples) < 3: m_examples.append(text)
 
@@ -56,10 +65,9 @@ def check_data():
     # Deep dive into "washing" contexts
     print("\n--- Investigating 'Washing' Contexts ---")
     found_compound = False
-    for item in data_list:
-        text = item['text'].lower()
-        if "washing" in text:
-            indices = [i for i in range(len(text)) if text.startswith("washing", i)]
+    for text, hits in doc_hits:
+        if hits:
+            indices = [i for i, keyword in hits if keyword == "washing"]
             for i in indices:
                 context = text[i:i+30]
                 # print(f"Context: '{context}'") 
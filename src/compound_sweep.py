@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+import torch
+
+from accumulators import cosine_sim
+from decomposition import batched_lstsq
+from activation_extractor import pad_batch, gather_sequence_residuals
+from token_patterns import compound_masks, mask_to_indices
+from token_index import compound_targets
+
+CATEGORIES = ["modifier", "modifier_in_compound", "modifier_alone", "compound_head", "other_head"]
+
+# Optional: one compound per line, head word last
+COMPOUNDS_PATH = "datasets/compounds.txt"
+
+# Used when COMPOUNDS_PATH does not exist
+DEFAULT_COMPOUNDS = [
+    "washing machine",
+    "sewing machine",
+    "time machine",
+    "coffee machine",
+    "vending machine",
+    "slot machine",
+    "fax machine",
+    "ice cream",
+    "hot dog",
+]
+
+
+def load_compounds(path=COMPOUNDS_PATH):
+    """Compounds listed in path, one per line, or DEFAULT_COMPOUNDS if the file does not exist."""
+    if not os.path.exists(path):
+        return list(DEFAULT_COMPOUNDS)
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def parse_compound(model, compound):
+    """
+    Split "washing machine" into token ids for the modifier (" washing") and the head
+    (" machine", the last word). Both get a leading space, as they appear mid-sentence.
+    """
+    words = compound.split()
+    if len(words) < 2:
+        raise ValueError(f"Compound needs a modifier and a head: {compound!r}")
+    modifier = " " + " ".join(words[:-1])
+    head = " " + words[-1]
+    encode = lambda s: model.tokenizer(s, add_special_tokens=False)["input_ids"]
+    return encode(modifier), encode(head)
+
+
+def sweep_targets(token_seqs, compound_ids, chunk_size=256):
+    """
+    Classify every compound over the corpus in padded chunks.
+    Compounds whose modifier and head tokens are both absent from a chunk are skipped.
+    Returns dict compound -> dict category -> list of (doc_id, pos).
+    """
+    targets = {name: {cat: [] for cat in CATEGORIES} for name in compound_ids}
+    for start in range(0, len(token_seqs), chunk_size):
+        chunk = token_seqs[start:start + chunk_size]
+        if not chunk:
+            continue
+        tokens, attention_mask = pad_batch(chunk)
+        present = set(torch.unique(tokens[attention_mask.bool()]).tolist())
+        for name, (modifier, head) in compound_ids.items():
+            if not (set(modifier) <= present or set(head) <= present):
+                continue
+            for cat, mask in compound_masks(tokens, modifier, head, attention_mask).items():
+                batch_idx, positions = mask_to_indices(mask)
+                targets[name][cat].extend(zip((batch_idx + start).tolist(), positions.tolist()))
+    return targets
+
+
+def compound_metrics(activations):
+    """
+    The run_experiment.py metrics for one compound, from dict category -> [n, d_model]:
+      sim_compound_vs_other_head  cos(mean compound head, mean other head)
+      sim_diff_vs_modifier        cos(mean compound head - mean other head, mean modifier)
+    Metrics needing an empty category are None.
+    """
+    means = {cat: acts.mean(axis=0) for cat, acts in activations.items() if len(acts)}
+    metrics = {"sim_compound_vs_other_head": None, "sim_diff_vs_modifier": None}
+    if "compound_head" in means and "other_head" in means:
+        metrics["sim_compound_vs_other_head"] = cosine_sim(means["compound_head"], means["other_head"])
+        if "modifier" in means:
+            diff = means["compound_head"] - means["other_head"]
+            metrics["sim_diff_vs_modifier"] = cosine_sim(diff, means["modifier"])
+    return metrics
+
+
+def run_sweep(model, token_seqs, compounds, hook_name="blocks.11.hook_resid_post", batch_size=32,
+              max_tokens=None, chunk_size=256, cache=None, token_index=None):
+    """
+    Compositionality analysis for many compounds with one forward pass per document.
+
+    All positions needed by any compound are gathered together, so each document is run
+    once no matter how many compounds occur in it; cost scales with the corpus, not
+    compounds x corpus. Each row also gets the decomposition compound head ≈
+    alpha * modifier + beta * other head. With a token_index (see
+    token_index.build_token_index) targets come from postings lookups instead of a scan
+    over the corpus.
+    Returns one result row (dict) per compound.
+    """
+    compound_ids = {name: parse_compound(model, name) for name in compounds}
+    if token_index is not None:
+        targets = {
+            name: compound_targets(token_index, modifier, head) for name, (modifier, head) in compound_ids.items()
+        }
+    else:
+        targets = sweep_targets(token_seqs, compound_ids, chunk_size=chunk_size)
+
+    all_targets = sorted({t for by_cat in targets.values() for ts in by_cat.values() for t in ts})
+    row_of = {t: r for r, t in enumerate(all_targets)}
+    vectors = gather_sequence_residuals(
+        model, token_seqs, all_targets, [hook_name], batch_size=batch_size, max_tokens=max_tokens, cache=cache
+    )[:, 0].numpy()
+
+    rows = []
+    fit_rows, fit_targets, fit_basis = [], [], []
+    for name in compounds:
+        modifier, head = compound_ids[name]
+        activations = {
+            cat: vectors[[row_of[t] for t in targets[name][cat]]] for cat in CATEGORIES
+        }
+        metrics = compound_metrics(activations)
+        metrics.update({"alpha_modifier": None, "beta_head": None, "r2": None, "resid_ratio": None})
+        if all(len(activations[cat]) for cat in ("compound_head", "modifier", "other_head")):
+            fit_rows.append(len(rows))
+            fit_targets.append(activations["compound_head"].mean(axis=0))
+            fit_basis.append([activations["modifier"].mean(axis=0), activations["other_head"].mean(axis=0)])
+        rows.append({
+            "compound": name,
+            "modifier_tokens": modifier,
+            "head_tokens": head,
+            "hook_name": hook_name,
+            "counts": {cat: len(acts) for cat, acts in activations.items()},
+            "metrics": metrics,
+        })
+
+    # compound head ≈ alpha * modifier + beta * other head, all compounds in one batched solve
+    if fit_rows:
+        fit = batched_lstsq(np.stack(fit_targets), np.stack(fit_basis).transpose(0, 2, 1))
+        for i, r in enumerate(fit_rows):
+            rows[r]["metrics"].update({
+                "alpha_modifier": float(fit["coefs"][i, 0]),
+                "beta_head": float(fit["coefs"][i, 1]),
+                "r2": float(fit["r2"][i]),
+                "resid_ratio": float(fit["resid_ratio"][i]),
+            })
+    return rows
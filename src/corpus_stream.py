@@ -0,0 +1,118 @@
+import glob
+import json
+import os
+
+from accumulators import RunningStats
+from activation_extractor import tokenize_corpus, accumulate_category_stats
+from keyword_matcher import KeywordMatcher
+
+
+def keyword_prefilter(keywords):
+    """
+    Case-insensitive substring test on raw bytes: fn(data: bytes) -> bool.
+    Runs before any decoding / JSON parsing, so non-matching records cost one scan
+    per keyword, or a single Aho-Corasick pass for sweep-sized keyword lists (see
+    KeywordMatcher.contains_any).
+    No keywords means keep everything.
+    """
+    patterns = [k.lower().encode("utf-8") for k in keywords or []]
+    if not patterns:
+        return lambda data: True
+    matcher = KeywordMatcher(patterns)
+    return lambda data: matcher.contains_any(data.lower())
+
+
+def iter_text_file(path, keep):
+    """One document per non-empty line (WikiText layout)."""
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip() and keep(line):
+                yield line.decode("utf-8", errors="replace").rstrip("\n")
+
+
+def iter_jsonl_file(path, keep, text_field="text"):
+    """One JSON object per line; lines are prefiltered before being parsed."""
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip() and keep(line):
+                text = json.loads(line).get(text_field)
+                if text:
+                    yield text
+
+
+def iter_arrow_file(path, keep, text_field="text"):
+    """
+    Arrow IPC file or stream (the format datasets.save_to_disk writes), read one
+    record batch at a time.
+    """
+    import pyarrow as pa
+
+    with open(path, "rb") as f:
+        try:
+            reader = pa.ipc.open_stream(f)
+            batches = iter(reader)
+        except pa.ArrowInvalid:
+            f.seek(0)
+            reader = pa.ipc.open_file(f)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        for batch in batches:
+            for value in batch.column(batch.schema.get_field_index(text_field)):
+                text = value.as_py()
+                if text and keep(text.encode("utf-8")):
+                    yield text
+
+
+def corpus_files(path):
+    """A single file, or every .txt / .jsonl / .arrow file under a directory (sorted)."""
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for ext in ("txt", "jsonl", "arrow"):
+        files.extend(glob.glob(os.path.join(path, "**", f"*.{ext}"), recursive=True))
+    return sorted(files)
+
+
+def iter_corpus(path, keywords=None, text_field="text"):
+    """
+    Lazily yield document texts from a local corpus (file or directory), keeping only
+    documents that contain one of the keywords (case-insensitive). Nothing is
+    materialized; memory is bounded by the largest single record / record batch.
+    """
+    keep = keyword_prefilter(keywords)
+    for file_path in corpus_files(path):
+        if file_path.endswith(".jsonl"):
+            yield from iter_jsonl_file(file_path, keep, text_field)
+        elif file_path.endswith(".arrow"):
+            yield from iter_arrow_file(file_path, keep, text_field)
+        else:
+            yield from iter_text_file(file_path, keep)
+
+
+def iter_token_batches(model, texts, docs_per_batch=1024, prepend_bos=True):
+    """Group a text iterator into chunks and tokenize each chunk in one tokenizer call."""
+    chunk = []
+    for text in texts:
+        chunk.append(text)
+        if len(chunk) >= docs_per_batch:
+            yield tokenize_corpus(model, chunk, prepend_bos=prepend_bos)
+            chunk = []
+    if chunk:
+        yield tokenize_corpus(model, chunk, prepend_bos=prepend_bos)
+
+
+def stream_category_stats(model, path, select_masks, keywords=None, hook_name="blocks.11.hook_resid_post",
+                          text_field="text", docs_per_batch=1024, batch_size=32, track_cov=False):
+    """
+    Read -> prefilter -> tokenize -> extract -> accumulate, one chunk at a time.
+    Returns (dict category -> RunningStats, n_documents) for corpora far larger than RAM.
+    """
+    stats = {}
+    n_documents = 0
+    for token_seqs in iter_token_batches(model, iter_corpus(path, keywords, text_field), docs_per_batch):
+        n_documents += len(token_seqs)
+        chunk_stats = accumulate_category_stats(
+            model, token_seqs, select_masks, hook_name=hook_name, batch_size=batch_size, track_cov=track_cov
+        )
+        for cat, chunk_stat in chunk_stats.items():
+            stats.setdefault(cat, RunningStats(model.cfg.d_model, track_cov)).merge(chunk_stat)
+    return stats, n_documents
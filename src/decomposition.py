@@ -0,0 +1,128 @@
+import numpy as np
+
+SOLVERS = ["ols", "ridge", "nnls"]
+
+
+def _fit_stats(targets, basis, coefs):
+    resid = targets - (basis @ coefs[..., None])[..., 0]
+    ss_res = (resid ** 2).sum(axis=-1)
+    ss_tot = ((targets - targets.mean(axis=-1, keepdims=True)) ** 2).sum(axis=-1)
+    r2 = np.where(ss_tot > 0, 1.0 - ss_res / np.where(ss_tot > 0, ss_tot, 1.0), 0.0)
+    resid_norm = np.sqrt(ss_res)
+    target_norm = np.linalg.norm(targets, axis=-1)
+    return {
+        "coefs": coefs,
+        "r2": r2,
+        "resid_norm": resid_norm,
+        "resid_ratio": resid_norm / np.where(target_norm > 0, target_norm, 1.0),
+    }
+
+
+def batched_lstsq(targets, basis):
+    """
+    Least squares target ≈ sum_k coef_k * basis_k for a whole stack of problems at once.
+
+    targets: [..., d_model]; basis: [..., d_model, k], with any leading batch dims
+    (layers, compounds x layers, ...). As in analysis_orthogonal.py the d_model
+    dimensions are the samples and there is no intercept. One batched SVD pseudo-inverse
+    of the bases themselves replaces a LinearRegression fit per problem (no X^T X, so the
+    condition number is not squared); rank-deficient bases get the minimum-norm
+    solution, like np.linalg.lstsq.
+
+    Returns dict of arrays over the batch dims:
+      coefs        [..., k]
+      r2           sklearn's score (centered total sum of squares), 0 for a constant target
+      resid_norm   ||target - fit||
+      resid_ratio  resid_norm / ||target||
+    """
+    targets = np.asarray(targets, dtype=np.float64)
+    basis = np.asarray(basis, dtype=np.float64)
+    return _fit_stats(targets, basis, _solve_ols(basis, targets))
+
+
+def _solve_ols(basis, targets):
+    # Same singular value cutoff as np.linalg.lstsq
+    rcond = np.finfo(basis.dtype).eps * max(basis.shape[-2:])
+    return (np.linalg.pinv(basis, rcond) @ targets[..., None])[..., 0]
+
+
+def _solve_ridge(gram, rhs, l2):
+    k = gram.shape[-1]
+    return np.linalg.solve(gram + l2 * np.eye(k), rhs[..., None])[..., 0]
+
+
+def _solve_nnls(gram, rhs, max_iter, tol):
+    """
+    Batched non-negative least squares on the normal equations by accelerated projected
+    gradient (FISTA). Every problem in the batch takes the same steps, so the work is a
+    few [..., k, k] matmuls per iteration regardless of how many problems there are.
+    Returns (coefs, converged bool array).
+    """
+    # Step 1 / L with L the largest eigenvalue of each Gram matrix
+    lipschitz = np.linalg.eigvalsh(gram)[..., -1]
+    step = 1.0 / np.where(lipschitz > 0, lipschitz, 1.0)
+    coefs = np.zeros(rhs.shape)
+    momentum = coefs
+    t = 1.0
+    converged = np.zeros(rhs.shape[:-1], dtype=bool)
+    for _ in range(max_iter):
+        grad = (gram @ momentum[..., None])[..., 0] - rhs
+        new = np.maximum(momentum - step[..., None] * grad, 0.0)
+        converged = np.abs(new - coefs).max(axis=-1) <= tol * np.maximum(np.abs(new).max(axis=-1), 1.0)
+        t_next = (1.0 + np.sqrt(1.0 + 4.0 * t * t)) / 2.0
+        momentum = new + ((t - 1.0) / t_next) * (new - coefs)
+        coefs, t = new, t_next
+        if converged.all():
+            break
+    return coefs, converged
+
+
+def decompose(targets, basis, solver="ols", l2=1.0, names=None, max_iter=5000, tol=1e-8):
+    """
+    Fit target ≈ sum_k coef_k * basis_k for a stack of problems with an arbitrary basis
+    (washing, machine, other modifiers, a mean-activation bias column, ...).
+
+    targets: [..., d_model]; basis: [..., d_model, k]. Batch dims broadcast, so one basis
+    per layer [layers, d_model, k] can serve many targets [n_targets, layers, d_model].
+    solver:
+      "ols"    minimum-norm least squares (as batched_lstsq)
+      "ridge"  least squares + l2 * ||coefs||^2
+      "nnls"   least squares with coefs >= 0 (iterative, see max_iter / tol)
+    Ridge and NNLS only factor [..., k, k] Gram matrices, so bases with hundreds of
+    vectors are fine; OLS takes the SVD of each [d_model, k] basis.
+
+    Returns batched_lstsq's dict plus, per component:
+      contribution    coef_k * <basis_k, target> / ||target||^2; these sum to
+                      <fit, target> / ||target||^2 (= 1 - resid_ratio^2 for OLS)
+      component_norm  |coef_k| * ||basis_k||
+    and "names" when given. NNLS adds "converged" [...].
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver {solver!r}, expected one of {SOLVERS}")
+    targets = np.asarray(targets, dtype=np.float64)
+    basis = np.asarray(basis, dtype=np.float64)
+    if names is not None and len(names) != basis.shape[-1]:
+        raise ValueError(f"{len(names)} names for {basis.shape[-1]} basis vectors")
+
+    # <basis_k, target> for every component: [..., k]
+    rhs = (np.swapaxes(basis, -1, -2) @ targets[..., None])[..., 0]
+    extra = {}
+    if solver == "ols":
+        coefs = _solve_ols(basis, targets)
+    else:
+        gram = np.swapaxes(basis, -1, -2) @ basis
+        gram, rhs_b = np.broadcast_arrays(gram, rhs[..., None])
+        rhs_b = rhs_b[..., 0]
+        if solver == "ridge":
+            coefs = _solve_ridge(gram, rhs_b, l2)
+        else:
+            coefs, extra["converged"] = _solve_nnls(gram, rhs_b, max_iter, tol)
+
+    fit = _fit_stats(targets, basis, coefs)
+    target_sq = (targets ** 2).sum(axis=-1, keepdims=True)
+    fit["contribution"] = coefs * rhs / np.where(target_sq > 0, target_sq, 1.0)
+    fit["component_norm"] = np.abs(coefs) * np.linalg.norm(basis, axis=-2)
+    fit.update(extra)
+    if names is not None:
+        fit["names"] = list(names)
+    return fit
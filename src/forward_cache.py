@@ -0,0 +1,138 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from activation_store import CACHE_ROOT
+
+FORWARD_CACHE_DIR = os.path.join(CACHE_ROOT, "forward_cache")
+
+
+def forward_key(model_name, tokens, hook_names):
+    """Content address of one sequence's forward: hash(model, token ids, hook set)."""
+    h = hashlib.sha256()
+    h.update(model_name.encode("utf-8"))
+    h.update(b"\0")
+    h.update(",".join(hook_names).encode("utf-8"))
+    h.update(b"\0")
+    h.update(np.asarray(tokens, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+class ForwardCache:
+    """
+    Cache of gathered residual rows per sequence, keyed by forward_key.
+
+    An entry is (positions, rows): the sorted positions gathered so far and their rows
+    [n_positions, n_hooks, d_model]. A request for other positions of the same
+    sequence is a partial hit; only the missing rows are computed, then merged into
+    the entry (see put), so only positions that were asked for are ever stored.
+
+    The in-memory tier is an LRU bounded by max_bytes. With disk_dir set, every entry
+    is also written there as .npz so other scripts / later runs can reuse it; entries
+    evicted from memory are re-read from disk on the next request.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.partial_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rows_requested = 0
+        self.rows_cached = 0
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        """Return the (positions, rows) entry or None, without touching the counters."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.disk_dir is not None and os.path.exists(self._disk_path(key)):
+            with np.load(self._disk_path(key)) as stored:
+                entry = (stored["positions"], torch.from_numpy(stored["rows"]))
+            self.disk_hits += 1
+            self._put_memory(key, entry)
+            return entry
+        return None
+
+    def lookup(self, key, positions):
+        """
+        Entry for key and the requested positions it lacks: (entry or None, missing).
+        Counts a hit when nothing is missing, a partial hit when some rows are cached
+        and a miss otherwise.
+        """
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+        entry = self.get(key)
+        missing = positions if entry is None else np.setdiff1d(positions, entry[0])
+        self.rows_requested += len(positions)
+        self.rows_cached += len(positions) - len(missing)
+        if entry is None:
+            self.misses += 1
+        elif len(missing):
+            self.partial_hits += 1
+        else:
+            self.hits += 1
+        return entry, missing
+
+    def put(self, key, positions, rows):
+        """Merge rows [n, n_hooks, d_model] at positions into the entry; returns the merged entry."""
+        positions = np.asarray(positions, dtype=np.int64)
+        rows = rows.detach().cpu()
+        entry = self.get(key)
+        if entry is not None:
+            positions = np.concatenate([entry[0], positions])
+            rows = torch.cat([entry[1], rows])
+        positions, first = np.unique(positions, return_index=True)
+        entry = (positions, rows[torch.from_numpy(first)])
+        self._put_memory(key, entry)
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so a concurrent reader never sees a partial file
+            tmp_path = path + ".tmp.npz"
+            np.savez(tmp_path, positions=entry[0], rows=entry[1].numpy())
+            os.replace(tmp_path, path)
+        return entry
+
+    def _put_memory(self, key, entry):
+        size = entry[1].numel() * entry[1].element_size()
+        if key in self.entries:
+            old = self.entries.pop(key)
+            self.current_bytes -= old[1].numel() * old[1].element_size()
+        if size > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= evicted[1].numel() * evicted[1].element_size()
+            self.evictions += 1
+
+    def stats(self):
+        requests = self.hits + self.partial_hits + self.misses
+        return {
+            "hits": self.hits,
+            "partial_hits": self.partial_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "row_hit_rate": self.rows_cached / self.rows_requested if self.rows_requested else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.current_bytes,
+        }
+
+
+# Shared by every vector extraction of the analysis scripts. Memory only: across runs
+# the activation store answers before the cache is asked, so a disk tier would only
+# hold a second copy.
+FORWARD_CACHE = ForwardCache()
@@ -0,0 +1,84 @@
+from collections import deque
+
+# Up to this many keywords, contains_any runs one C-level substring search per keyword,
+# which beats the per-character automaton (crossover measured at ~200 keywords)
+SUBSTRING_MAX_KEYWORDS = 128
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over many keywords; one pass per document finds every hit.
+
+    Keywords may be str or bytes (matching str or bytes input respectively). The goto
+    and failure links are compiled into a full transition table, so scanning is one
+    dict lookup per character regardless of the number of keywords.
+    Matching is case-sensitive; lowercase both keywords and text for case-insensitive use.
+    contains_any falls back to plain substring tests for short keyword lists (see
+    SUBSTRING_MAX_KEYWORDS); find_all always scans with the automaton.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keywords))
+        self.transitions = [{}]
+        self.outputs = [[]]  # state -> indices of keywords ending here
+        for k, keyword in enumerate(self.keywords):
+            if not keyword:
+                raise ValueError("Empty keyword")
+            state = 0
+            for ch in keyword:
+                if ch not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.outputs.append([])
+                    self.transitions[state][ch] = len(self.transitions) - 1
+                state = self.transitions[state][ch]
+            self.outputs[state].append(k)
+        self._compile()
+
+    def _compile(self):
+        # BFS: each state inherits the (already complete) transitions and outputs of its
+        # failure state, turning the trie into a DFA
+        fail = [0] * len(self.transitions)
+        goto = [dict(t) for t in self.transitions]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in goto[state].items():
+                queue.append(child)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(ch, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[fail[child]]
+            for ch, target in self.transitions[fail[state]].items():
+                self.transitions[state].setdefault(ch, target)
+
+    def find_all(self, text):
+        """All hits as (start_offset, keyword), in order of their end offset."""
+        transitions = self.transitions
+        outputs = self.outputs
+        keywords = self.keywords
+        hits = []
+        state = 0
+        for i, ch in enumerate(text):
+            state = transitions[state].get(ch, 0)
+            if outputs[state]:
+                for k in outputs[state]:
+                    hits.append((i - len(keywords[k]) + 1, keywords[k]))
+        return hits
+
+    def found(self, text):
+        """Set of keywords occurring in text."""
+        return {keyword for _, keyword in self.find_all(text)}
+
+    def contains_any(self, text):
+        """True as soon as any keyword is seen (early exit)."""
+        if len(self.keywords) <= SUBSTRING_MAX_KEYWORDS:
+            return any(keyword in text for keyword in self.keywords)
+        transitions = self.transitions
+        outputs = self.outputs
+        state = 0
+        for ch in text:
+            state = transitions[state].get(ch, 0)
+            if outputs[state]:
+                return True
+        return False
@@ -0,0 +1,70 @@
+import numpy as np
+import torch
+
+from activation_extractor import gather_sequence_residuals, layer_hook_names
+
+
+def unembed_rows(model, residuals):
+    """
+    ln_final + unembedding for gathered residual rows of any shape [..., d_model]
+    -> logits [..., d_vocab]. Applied to the last layer's resid_post this is exactly
+    the model's output logits at those positions.
+    """
+    residuals = residuals.to(model.cfg.device)
+    return model.ln_final(residuals) @ model.W_U + model.b_U
+
+
+def logit_lens(model, token_seqs, targets, target_token_ids=None, k=5, layers=None, batch_size=32,
+               max_tokens=None, cache=None, chunk_rows=64):
+    """
+    Logit lens at every layer for a list of (seq_idx, pos) targets.
+
+    One batched forward per length bucket gathers only the target rows of each
+    blocks.{L}.hook_resid_post (see gather_sequence_residuals); ln_final + unembed
+    then run on those rows alone, chunk_rows targets x all layers per matmul. Cost is
+    O(layers x targets x d_vocab) rather than a full [seq, d_vocab] logit tensor per
+    prompt per layer.
+
+    target_token_ids: optional token id, or one id per target, whose probability and
+    rank (number of tokens with a higher logit, 0 = top) are reported.
+    Returns dict:
+      layers        list of layer numbers
+      top_ids       [n_targets, n_layers, k] int64
+      top_probs     [n_targets, n_layers, k]
+      target_prob   [n_targets, n_layers]   (with target_token_ids)
+      target_rank   [n_targets, n_layers]   (with target_token_ids)
+    """
+    # Sorted: gathered hooks come back in the order they fire
+    layers = list(range(model.cfg.n_layers)) if layers is None else sorted(layers)
+    hook_names = [layer_hook_names("hook_resid_post", L, L)[0] for L in layers]
+    residuals = gather_sequence_residuals(
+        model, token_seqs, targets, hook_names, batch_size=batch_size, max_tokens=max_tokens, cache=cache
+    )
+
+    n = len(targets)
+    if target_token_ids is not None:
+        target_token_ids = torch.from_numpy(np.broadcast_to(np.asarray(target_token_ids, dtype=np.int64), (n,)).copy())
+    out = {
+        "layers": layers,
+        "top_ids": np.zeros((n, len(layers), k), dtype=np.int64),
+        "top_probs": np.zeros((n, len(layers), k), dtype=np.float32),
+    }
+    if target_token_ids is not None:
+        out["target_prob"] = np.zeros((n, len(layers)), dtype=np.float32)
+        out["target_rank"] = np.zeros((n, len(layers)), dtype=np.int64)
+
+    with torch.no_grad():
+        for start in range(0, n, chunk_rows):
+            rows = slice(start, start + chunk_rows)
+            # [chunk, n_layers, d_vocab]
+            logits = unembed_rows(model, residuals[rows]).float()
+            log_probs = torch.log_softmax(logits, dim=-1)
+            top = torch.topk(log_probs, k=k, dim=-1)
+            out["top_ids"][rows] = top.indices.cpu().numpy()
+            out["top_probs"][rows] = top.values.exp().cpu().numpy()
+            if target_token_ids is not None:
+                ids = target_token_ids[rows].to(logits.device)[:, None, None].expand(-1, len(layers), 1)
+                target_logit = logits.gather(-1, ids)
+                out["target_prob"][rows] = log_probs.gather(-1, ids)[..., 0].exp().cpu().numpy()
+                out["target_rank"][rows] = (logits > target_logit).sum(dim=-1).cpu().numpy()
+    return out
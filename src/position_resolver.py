@@ -0,0 +1,101 @@
+import re
+
+import numpy as np
+
+from activation_extractor import select_corpus_positions
+from token_patterns import match_ngram
+
+
+def word_token_ids(model, word):
+    """Token ids of word as written, e.g. " machine" -> [4572] (keep the leading space)."""
+    return model.tokenizer(word, add_special_tokens=False)["input_ids"]
+
+
+# tokenizer -> set of ids that continue a word (see word_continuation_ids)
+_continuation_ids = {}
+
+
+def word_continuation_ids(model):
+    """
+    Ids of tokens that glue onto the previous token as part of the same word, i.e. whose
+    text starts with a letter or digit ("machine" in "washingmachine", "s" in " machines").
+    Computed once per tokenizer.
+    """
+    tokenizer = model.tokenizer
+    if id(tokenizer) not in _continuation_ids:
+        pieces = tokenizer.batch_decode([[i] for i in range(len(tokenizer))], clean_up_tokenization_spaces=False)
+        _continuation_ids[id(tokenizer)] = {i for i, piece in enumerate(pieces) if piece[:1].isalnum()}
+    return _continuation_ids[id(tokenizer)]
+
+
+def resolve_token_positions(token_seqs, ids, anchor=-1, exclude_next=None, chunk_size=256):
+    """
+    Every (doc_id, pos) where the id sequence ids occurs, sorted; pos marks ids[anchor]
+    (default the last token). Exact id matching, vectorized over padded chunks.
+    exclude_next: ids that may not follow the match (e.g. word_continuation_ids, so
+    " washing" in " washingmachine" is not a hit).
+    """
+    ids = [int(t) for t in ids]
+    if not ids:
+        raise ValueError("Empty token id sequence")
+
+    def select(tokens, mask):
+        hit = match_ngram(tokens, ids, anchor, mask)
+        if exclude_next:
+            hit &= ~match_ngram(tokens, ids + [exclude_next], anchor % len(ids), mask)
+        return {"hit": hit}
+
+    return select_corpus_positions(token_seqs, select, chunk_size).get("hit", [])
+
+
+def resolve_char_positions(model, texts, word, prepend_bos=True, anchor=-1):
+    """
+    Every (doc_id, pos) of word by character span: whole-word matches of word.strip()
+    in each text (so "machines" does not match "machine") are mapped to the tokens
+    overlapping the span via the tokenizer's offset mapping, whatever the word's
+    tokenization in context. pos marks the last overlapping token (anchor=-1) or the
+    first (anchor=0). Positions match tokenize_corpus(model, texts, prepend_bos);
+    spans cut off by n_ctx truncation are dropped. Needs a fast tokenizer.
+    """
+    texts = list(texts)
+    prefix = model.tokenizer.bos_token if prepend_bos else ""
+    encoded = model.tokenizer(
+        [prefix + t for t in texts],
+        add_special_tokens=False,
+        truncation=True,
+        max_length=model.cfg.n_ctx,
+        return_offsets_mapping=True,
+    )["offset_mapping"]
+    pattern = re.compile(r"(?<!\w)" + re.escape(word.strip()) + r"(?!\w)")
+
+    targets = []
+    for doc_id, (text, offsets) in enumerate(zip(texts, encoded)):
+        offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+        for match in pattern.finditer(text):
+            start, end = match.start() + len(prefix), match.end() + len(prefix)
+            # Tokens overlapping [start, end); offsets are sorted by position
+            first = np.searchsorted(offsets[:, 1], start, side="right")
+            last = np.searchsorted(offsets[:, 0], end, side="left") - 1
+            if first > last:
+                continue
+            targets.append((doc_id, int(last if anchor == -1 else first)))
+    return targets
+
+
+def resolve_word_positions(model, texts, token_seqs, word, anchor=-1):
+    """
+    All occurrences of word in a corpus, as sorted (doc_id, pos).
+    Words that are a single token are matched by id over token_seqs (not when glued to
+    a following word piece); longer words by character span (resolve_char_positions),
+    since their tokenization depends on context.
+    """
+    ids = word_token_ids(model, word)
+    if len(ids) == 1:
+        return resolve_token_positions(token_seqs, ids, anchor, exclude_next=word_continuation_ids(model))
+    return resolve_char_positions(model, texts, word, anchor=anchor)
+
+
+def missing_documents(n_documents, targets):
+    """Ids of documents with no resolved position, for reporting instead of guessing one."""
+    found = {doc_id for doc_id, _ in targets}
+    return [doc_id for doc_id in range(n_documents) if doc_id not in found]
@@ -0,0 +1,104 @@
+import numpy as np
+import torch
+
+from activation_extractor import iter_sequence_residuals, layer_hook_names
+
+# Thresholds reported as top-k hit rates
+TOP_K_RATES = [1, 10, 100]
+
+
+def candidate_log_probs(model, normed, candidate_ids, vocab_chunk=4096, rank=True):
+    """
+    Next-token log-probabilities of a few candidate tokens without a full logit row.
+
+    normed: ln_final output rows [n, d_model]. Candidate logits come from the gathered
+    W_U columns; the log-partition log sum_v exp(logit_v) is exact, accumulated over
+    vocab_chunk columns at a time with a running max, so [n, d_vocab] is never held.
+    With rank, the number of other tokens scoring above each candidate (0 = top) is
+    counted in the same pass; the candidate's own column is skipped, since its chunk
+    logit can differ from the gathered one in the last bit.
+    Returns (log_probs [n, n_candidates], ranks [n, n_candidates] or None, log_z [n]).
+    """
+    W_U, b_U = model.W_U, model.b_U
+    candidates = torch.as_tensor(candidate_ids, dtype=torch.long, device=W_U.device)
+    candidate_logits = normed @ W_U[:, candidates] + b_U[candidates]
+
+    running_max = torch.full((len(normed),), -float("inf"), dtype=normed.dtype, device=normed.device)
+    running_sum = torch.zeros(len(normed), dtype=normed.dtype, device=normed.device)
+    ranks = torch.zeros(candidate_logits.shape, dtype=torch.long, device=normed.device) if rank else None
+    for start in range(0, W_U.shape[-1], vocab_chunk):
+        logits = normed @ W_U[:, start:start + vocab_chunk] + b_U[start:start + vocab_chunk]
+        new_max = torch.maximum(running_max, logits.max(dim=-1).values)
+        running_sum = running_sum * torch.exp(running_max - new_max) + torch.exp(logits - new_max[:, None]).sum(-1)
+        running_max = new_max
+        if rank:
+            above = logits[:, :, None] > candidate_logits[:, None, :]
+            own = candidates - start
+            in_chunk = torch.nonzero((own >= 0) & (own < logits.shape[-1]))[:, 0]
+            above[:, own[in_chunk], in_chunk] = False
+            ranks += above.sum(dim=1)
+    log_z = running_max + torch.log(running_sum)
+    return candidate_logits - log_z[:, None], ranks, log_z
+
+
+def profile_next_tokens(model, token_seqs, groups, candidate_ids, batch_size=32, max_tokens=None,
+                        vocab_chunk=4096, cache=None):
+    """
+    Corpus-scale next-token profile for a few candidate tokens.
+
+    groups: dict name -> list of (doc_id, pos), e.g. every occurrence of a modifier
+    (token_index.ngram_postings(..., anchor=-1)). The prediction at pos is for the
+    token after it. Targets are streamed one length-bucketed batch at a time: only the
+    final resid_post rows at targets are gathered (the forward stops before ln_final and
+    the unembedding), then ln_final + candidate_log_probs run on those rows. Per-target
+    results are folded into sums and dropped.
+
+    Returns dict name -> {"count", "candidates": {candidate id -> {"mean_prob",
+    "mean_log_prob", "mean_rank", "top1_rate", "top10_rate", "top100_rate"}}}.
+    """
+    candidate_ids = [int(c) for c in candidate_ids]
+    names = list(groups.keys())
+    targets = sorted({t for ts in groups.values() for t in ts})
+    row_of = {t: r for r, t in enumerate(targets)}
+    # Membership of each target row per group
+    members = np.zeros((len(targets), len(names)), dtype=bool)
+    for g, name in enumerate(names):
+        members[[row_of[t] for t in groups[name]], g] = True
+
+    shape = (len(names), len(candidate_ids))
+    sums = {key: np.zeros(shape) for key in ["prob", "log_prob", "rank"] + [f"top{k}" for k in TOP_K_RATES]}
+    hook_names = layer_hook_names("hook_resid_post", model.cfg.n_layers - 1, model.cfg.n_layers - 1)
+    with torch.no_grad():
+        for rows, residuals in iter_sequence_residuals(
+            model, token_seqs, targets, hook_names, batch_size=batch_size, max_tokens=max_tokens, cache=cache
+        ):
+            normed = model.ln_final(residuals[:, 0].to(model.cfg.device))
+            log_probs, ranks, _ = candidate_log_probs(model, normed, candidate_ids, vocab_chunk)
+            log_probs = log_probs.double().cpu().numpy()
+            ranks = ranks.cpu().numpy()
+            # [n_groups, batch] @ [batch, n_candidates]
+            weight = members[rows].T.astype(np.float64)
+            sums["prob"] += weight @ np.exp(log_probs)
+            sums["log_prob"] += weight @ log_probs
+            sums["rank"] += weight @ ranks
+            for k in TOP_K_RATES:
+                sums[f"top{k}"] += weight @ (ranks < k)
+
+    counts = members.sum(axis=0)
+    profile = {}
+    for g, name in enumerate(names):
+        by_candidate = {}
+        for j, c in enumerate(candidate_ids):
+            if not counts[g]:
+                by_candidate[c] = None
+                continue
+            stats = {
+                "mean_prob": sums["prob"][g, j] / counts[g],
+                "mean_log_prob": sums["log_prob"][g, j] / counts[g],
+                "mean_rank": sums["rank"][g, j] / counts[g],
+            }
+            for k in TOP_K_RATES:
+                stats[f"top{k}_rate"] = sums[f"top{k}"][g, j] / counts[g]
+            by_candidate[c] = {key: float(value) for key, value in stats.items()}
+        profile[name] = {"count": int(counts[g]), "candidates": by_candidate}
+    return profile
@@ -0,0 +1,91 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from activation_extractor import tokenize_corpus, accumulate_category_stats
+from token_patterns import compound_masks
+
+# Per-worker state, set once by _init_worker
+_worker_model = None
+
+
+def load_pretrained(model_name):
+    from transformer_lens import HookedTransformer
+    model = HookedTransformer.from_pretrained(model_name, device="cpu")
+    model.eval()
+    return model
+
+
+def _init_worker(model_loader, model_name, threads_per_worker):
+    global _worker_model
+    # One model copy per worker; cap intra-op threads so workers don't oversubscribe cores
+    torch.set_num_threads(threads_per_worker)
+    _worker_model = model_loader(model_name)
+
+
+def _extract_shard(texts, modifier, head, hook_name, batch_size, track_cov):
+    model = _worker_model
+    token_seqs = tokenize_corpus(model, texts, prepend_bos=True)
+    return accumulate_category_stats(
+        model,
+        token_seqs,
+        lambda tokens, mask: compound_masks(tokens, modifier, head, mask),
+        hook_name=hook_name,
+        batch_size=batch_size,
+        track_cov=track_cov,
+    )
+
+
+def shard_ranges(n_items, n_shards):
+    """Split range(n_items) into n_shards contiguous (start, stop) ranges of near-equal size."""
+    n_shards = max(1, min(n_shards, n_items))
+    bounds = np.linspace(0, n_items, n_shards + 1).astype(int)
+    return [(int(bounds[i]), int(bounds[i + 1])) for i in range(n_shards)]
+
+
+def merge_category_stats(shard_results):
+    """Merge per-shard dict category -> RunningStats."""
+    merged = {}
+    for result in shard_results:
+        for cat, stats in result.items():
+            if cat not in merged:
+                merged[cat] = stats
+            else:
+                merged[cat].merge(stats)
+    return merged
+
+
+def sharded_category_stats(model_name, texts, modifier, head, hook_name="blocks.11.hook_resid_post",
+                           n_workers=None, n_shards=None, threads_per_worker=None, batch_size=32,
+                           track_cov=False, model_loader=load_pretrained):
+    """
+    Extract compound categories (see token_patterns.compound_masks) over texts in a
+    process pool and return merged dict category -> accumulators.RunningStats.
+
+    The corpus is split into n_shards contiguous shards (default 4 per worker, so slow
+    shards balance out). Each worker loads its own model via model_loader(model_name)
+    and uses threads_per_worker intra-op threads (default cores // workers).
+    Call from under `if __name__ == "__main__":`, since workers are spawned.
+    """
+    texts = list(texts)
+    n_workers = n_workers or os.cpu_count()
+    n_shards = n_shards or n_workers * 4
+    threads_per_worker = threads_per_worker or max(1, os.cpu_count() // n_workers)
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(model_loader, model_name, threads_per_worker),
+    ) as pool:
+        futures = [
+            pool.submit(
+                _extract_shard, texts[start:stop], list(modifier), list(head), hook_name, batch_size, track_cov
+            )
+            for start, stop in shard_ranges(len(texts), n_shards)
+        ]
+        return merge_category_stats(f.result() for f in futures)
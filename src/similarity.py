@@ -0,0 +1,146 @@
+import numpy as np
+
+
+def normalize_rows(x):
+    """Rows scaled to unit norm as float32; all-zero rows stay zero."""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norms > 0, norms, 1.0)
+
+
+def iter_cosine_blocks(vectors, hook=0, block_rows=2048):
+    """
+    The full occurrence x occurrence cosine matrix of one hook (layer), block by block.
+
+    vectors: [n, n_hooks, d_model] (e.g. a memory-mapped store entry) or [n, d_model].
+    Yields (row_start, col_start, block) with block [<= block_rows, <= block_rows], so
+    only one normalized copy of the layer plus one block is in memory at a time.
+    """
+    unit = normalize_rows(vectors[:, hook] if np.ndim(vectors) == 3 else vectors)
+    n = len(unit)
+    for row_start in range(0, n, block_rows):
+        rows = unit[row_start:row_start + block_rows]
+        for col_start in range(0, n, block_rows):
+            yield row_start, col_start, rows @ unit[col_start:col_start + block_rows].T
+
+
+def _merge_topk(best_sims, best_ids, block, ids, k):
+    # Running top-k per row: append the block's columns and keep the k largest
+    if best_sims is not None:
+        block = np.concatenate([best_sims, block], axis=1)
+        ids = np.concatenate([best_ids, ids], axis=1)
+    if block.shape[1] > k:
+        keep = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        block = np.take_along_axis(block, keep, axis=1)
+        ids = np.take_along_axis(ids, keep, axis=1)
+    return block, ids
+
+
+def _sorted_topk(best_sims, best_ids):
+    order = np.argsort(-best_sims, axis=1, kind="stable")
+    return np.take_along_axis(best_ids, order, axis=1), np.take_along_axis(best_sims, order, axis=1)
+
+
+def cosine_topk(vectors, k=10, hook=0, block_rows=2048, exclude_self=True):
+    """
+    The k most cosine-similar occurrences of every occurrence, from the blocked matrix.
+
+    A running top-k per row is merged with each block (argpartition), so memory is
+    O(block_rows x (block_rows + k)) on top of the normalized layer.
+    Returns (neighbors [n, k] int64 row ids, sims [n, k] float32), most similar first.
+    """
+    n = len(vectors)
+    k = max(0, min(k, n - 1 if exclude_self else n))
+    neighbors = np.zeros((n, k), dtype=np.int64)
+    sims = np.zeros((n, k), dtype=np.float32)
+    if k == 0:
+        return neighbors, sims
+
+    best_sims = None
+    best_ids = None
+    for row_start, col_start, block in iter_cosine_blocks(vectors, hook, block_rows):
+        n_rows, n_cols = block.shape
+        if exclude_self and col_start < row_start + n_rows and row_start < col_start + n_cols:
+            # The diagonal runs through this block
+            r = np.arange(max(row_start, col_start), min(row_start + n_rows, col_start + n_cols))
+            block[r - row_start, r - col_start] = -np.inf
+        if col_start == 0:
+            best_sims = best_ids = None
+        ids = np.broadcast_to(np.arange(col_start, col_start + n_cols), block.shape)
+        best_sims, best_ids = _merge_topk(best_sims, best_ids, block, ids, k)
+        if col_start + n_cols == n:
+            rows = slice(row_start, row_start + n_rows)
+            neighbors[rows], sims[rows] = _sorted_topk(best_sims, best_ids)
+    return neighbors, sims
+
+
+def cosine_search(vectors, queries, k=10, hook=0, block_rows=2048):
+    """
+    Exact top-k by cosine of each query [n_queries, d_model] among the rows of one hook
+    of vectors, scanning the rows block by block (the reference for ann_index).
+    Returns (ids [n_queries, k], sims [n_queries, k]), most similar first.
+    """
+    layer = vectors[:, hook] if np.ndim(vectors) == 3 else vectors
+    queries = normalize_rows(np.atleast_2d(queries))
+    k = max(0, min(k, len(layer)))
+    best_sims = np.zeros((len(queries), 0), dtype=np.float32)
+    best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(layer), block_rows):
+        block = queries @ normalize_rows(layer[start:start + block_rows]).T
+        ids = np.broadcast_to(np.arange(start, start + block.shape[1]), block.shape)
+        best_sims, best_ids = _merge_topk(best_sims, best_ids, block, ids, k)
+    return _sorted_topk(best_sims, best_ids)
+
+
+def layer_topk(vectors, k=10, hooks=None, block_rows=2048, exclude_self=True):
+    """cosine_topk for every hook of vectors [n, n_hooks, d_model] -> ([n_hooks, n, k], [n_hooks, n, k])."""
+    hooks = range(vectors.shape[1]) if hooks is None else hooks
+    results = [cosine_topk(vectors, k, hook, block_rows, exclude_self) for hook in hooks]
+    return np.stack([r[0] for r in results]), np.stack([r[1] for r in results])
+
+
+def neighbor_category_stats(neighbors, labels, categories):
+    """
+    How the top-k neighbors of each category are labelled, to see whether a category
+    clusters apart (e.g. compound_head vs other_head) without averaging it first.
+
+    neighbors: [n, k] from cosine_topk; labels: bool [n, n_categories] (see
+    activation_extractor.build_index).
+    Returns dict category -> {"count", "neighbor_fraction": {category: fraction of the
+    neighbors carrying that label}, "base_rate": {category: fraction of all rows}}.
+    """
+    labels = np.asarray(labels, dtype=bool)
+    # [n, n_categories]: fraction of each row's neighbors in each category
+    neighbor_labels = labels[neighbors].mean(axis=1) if neighbors.shape[1] else np.zeros(labels.shape)
+    base_rate = labels.mean(axis=0) if len(labels) else np.zeros(len(categories))
+
+    stats = {}
+    for c, cat in enumerate(categories):
+        member = labels[:, c]
+        fractions = neighbor_labels[member].mean(axis=0) if member.any() else np.full(len(categories), np.nan)
+        stats[cat] = {
+            "count": int(member.sum()),
+            "neighbor_fraction": {other: float(fractions[o]) for o, other in enumerate(categories)},
+            "base_rate": {other: float(base_rate[o]) for o, other in enumerate(categories)},
+        }
+    return stats
+
+
+def mean_pairwise_cosine(vectors, labels, hook=0):
+    """
+    Mean cosine over all occurrence pairs between (and within) categories, exactly,
+    without forming the matrix: mean_{a in A, b in B} cos(a, b) = <sum unit(A), sum unit(B)>
+    / (|A| |B|). Self-pairs are excluded within a category.
+    Returns [n_categories, n_categories] (nan where there are no pairs).
+    """
+    labels = np.asarray(labels, dtype=bool)
+    unit = normalize_rows(vectors[:, hook] if np.ndim(vectors) == 3 else vectors).astype(np.float64)
+    sums = labels.T.astype(np.float64) @ unit
+    counts = labels.sum(axis=0).astype(np.float64)
+    dots = sums @ sums.T
+    pairs = np.outer(counts, counts)
+    # Within a category drop the n self-pairs (each contributes ||unit||^2 = 1)
+    n_self = (labels.T.astype(np.float64) @ (np.linalg.norm(unit, axis=1) ** 2))
+    dots[np.diag_indices_from(dots)] -= n_self
+    pairs[np.diag_indices_from(pairs)] -= counts
+    return np.where(pairs > 0, dots / np.where(pairs > 0, pairs, 1.0), np.nan)
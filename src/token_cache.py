@@ -0,0 +1,108 @@
+import json
+import os
+
+import numpy as np
+
+from activation_extractor import tokenize_corpus
+from activation_store import CACHE_ROOT, dataset_fingerprint, atomic_save
+from token_index import tokenizer_fingerprint
+
+TOKEN_CACHE_DIR = os.path.join(CACHE_ROOT, "token_cache")
+
+
+class TokenizedCorpus:
+    """
+    A tokenized corpus as one flat token array plus offsets [n_docs + 1].
+
+    corpus[i] is a zero-copy view of document i (a 1-D numpy array, memory-mapped
+    when loaded from the cache), so it can stand in for the list of token tensors
+    tokenize_corpus returns. Ids are uint16 when the vocabulary fits (GPT-2 does).
+    """
+
+    def __init__(self, tokens, offsets):
+        self.tokens = tokens
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+
+def token_dtype(vocab_size):
+    return np.uint16 if vocab_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+
+def build_tokenized_corpus(model, texts, prepend_bos=True, truncate=True, chunk_size=1024):
+    """Tokenize texts in chunks (one tokenizer call each) into a flat TokenizedCorpus."""
+    texts = list(texts)
+    dtype = token_dtype(len(model.tokenizer))
+    chunks = []
+    lengths = []
+    for start in range(0, len(texts), chunk_size):
+        chunk = texts[start:start + chunk_size]
+        for seq in tokenize_corpus(model, chunk, prepend_bos=prepend_bos, truncate=truncate):
+            chunks.append(seq.numpy().astype(dtype))
+            lengths.append(len(seq))
+    tokens = np.concatenate(chunks) if chunks else np.zeros(0, dtype=dtype)
+    offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64)
+    return TokenizedCorpus(tokens, offsets)
+
+
+def cache_dir(tokenizer_key, fingerprint, root=TOKEN_CACHE_DIR):
+    """Directory holding one (tokenizer, corpus) entry."""
+    return os.path.join(root, f"{tokenizer_key[:16]}-{fingerprint[:16]}")
+
+
+def save_tokenized_corpus(corpus, tokenizer_key, fingerprint, root=TOKEN_CACHE_DIR):
+    """Write tokens.npy, offsets.npy and meta.json (see activation_store.atomic_save)."""
+    meta = {
+        "tokenizer_key": tokenizer_key,
+        "fingerprint": fingerprint,
+        "n_documents": len(corpus),
+        "n_tokens": len(corpus.tokens),
+        "dtype": str(corpus.tokens.dtype),
+    }
+    path = cache_dir(tokenizer_key, fingerprint, root)
+    return atomic_save(path, {"tokens": corpus.tokens, "offsets": corpus.offsets}, meta)
+
+
+def load_tokenized_corpus(tokenizer_key, fingerprint, root=TOKEN_CACHE_DIR):
+    """Memory-mapped TokenizedCorpus, or None if this corpus was never tokenized with this tokenizer."""
+    path = cache_dir(tokenizer_key, fingerprint, root)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return TokenizedCorpus(
+        np.load(os.path.join(path, "tokens.npy"), mmap_mode="r"),
+        np.load(os.path.join(path, "offsets.npy"), mmap_mode="r"),
+    )
+
+
+def cached_tokenize(model, texts, prepend_bos=True, truncate=True, root=TOKEN_CACHE_DIR):
+    """
+    Drop-in for tokenize_corpus backed by the on-disk cache: the tokenizer only runs the
+    first time a corpus is seen with a given tokenizer (see token_index.tokenizer_fingerprint).
+    """
+    texts = list(texts)
+    tokenizer_key = tokenizer_fingerprint(model, prepend_bos, truncate)
+    fingerprint = dataset_fingerprint(texts)
+    corpus = load_tokenized_corpus(tokenizer_key, fingerprint, root)
+    if corpus is not None:
+        print(f"Loaded tokenized corpus from {cache_dir(tokenizer_key, fingerprint, root)}")
+        return corpus
+    corpus = build_tokenized_corpus(model, texts, prepend_bos, truncate)
+    save_tokenized_corpus(corpus, tokenizer_key, fingerprint, root)
+    return load_tokenized_corpus(tokenizer_key, fingerprint, root)
+
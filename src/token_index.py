@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from activation_store import CACHE_ROOT, dataset_fingerprint, atomic_save
+
+TOKEN_INDEX_DIR = os.path.join(CACHE_ROOT, "token_index")
+
+INDEX_ARRAYS = [
+    "unigram_keys", "unigram_offsets", "unigram_doc", "unigram_pos",
+    "bigram_keys", "bigram_offsets", "bigram_doc", "bigram_pos",
+]
+
+
+def tokenizer_fingerprint(model, prepend_bos=True, truncate=True):
+    """
+    Identity of the tokenization the index positions refer to: tokenizer name, vocab
+    size, BOS handling and n_ctx truncation (see activation_extractor.tokenize_corpus).
+    """
+    tokenizer = model.tokenizer
+    n_ctx = model.cfg.n_ctx if truncate else None
+    desc = f"{tokenizer.name_or_path}|{len(tokenizer)}|bos={prepend_bos}|n_ctx={n_ctx}"
+    return hashlib.sha256(desc.encode("utf-8")).hexdigest()
+
+
+def _postings(keys, doc_ids, positions):
+    # Stable sort keeps each postings list in (document, position) order
+    order = np.argsort(keys, kind="stable")
+    unique, starts = np.unique(keys[order], return_index=True)
+    offsets = np.append(starts, len(keys)).astype(np.int64)
+    return unique, offsets, doc_ids[order], positions[order]
+
+
+def build_token_index(token_seqs):
+    """
+    Inverted index over a tokenized corpus (list of 1-D token tensors or arrays, or a
+    token_cache.TokenizedCorpus).
+
+    Unigram postings map token id -> (doc, pos). Bigram postings map (a, b) ->
+    (doc, pos of a) for every adjacent pair. Each postings table is stored as sorted
+    keys + CSR offsets into flat doc / pos arrays, so a lookup is a binary search.
+    """
+    if hasattr(token_seqs, "offsets"):
+        # token_cache.TokenizedCorpus: already flat
+        lengths = np.diff(token_seqs.offsets).astype(np.int64)
+        flat = np.asarray(token_seqs.tokens, dtype=np.int64)
+    else:
+        lengths = np.array([len(seq) for seq in token_seqs], dtype=np.int64)
+        flat = np.concatenate([np.asarray(seq, dtype=np.int64) for seq in token_seqs]) if len(token_seqs) else \
+            np.zeros(0, dtype=np.int64)
+    doc_ids = np.repeat(np.arange(len(token_seqs), dtype=np.int64), lengths)
+    seq_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    positions = np.arange(len(flat), dtype=np.int64) - np.repeat(seq_starts, lengths)
+    vocab_size = int(flat.max()) + 1 if len(flat) else 1
+
+    index = {"vocab_size": vocab_size, "n_documents": len(token_seqs), "n_tokens": len(flat)}
+    (index["unigram_keys"], index["unigram_offsets"],
+     index["unigram_doc"], index["unigram_pos"]) = _postings(flat, doc_ids, positions)
+
+    # Adjacent pairs never cross a document boundary
+    pair = doc_ids[:-1] == doc_ids[1:]
+    bigram_keys = flat[:-1][pair] * vocab_size + flat[1:][pair]
+    (index["bigram_keys"], index["bigram_offsets"],
+     index["bigram_doc"], index["bigram_pos"]) = _postings(bigram_keys, doc_ids[:-1][pair], positions[:-1][pair])
+    return index
+
+
+def _lookup(keys, offsets, docs, positions, key):
+    i = np.searchsorted(keys, key)
+    if i == len(keys) or keys[i] != key:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    start, stop = offsets[i], offsets[i + 1]
+    return np.asarray(docs[start:stop]), np.asarray(positions[start:stop])
+
+
+def _pack(docs, positions):
+    # One sortable int64 key per (doc, pos), for set operations on postings
+    return (docs << 32) | positions
+
+
+def _unpack(packed):
+    return packed >> 32, packed & 0xFFFFFFFF
+
+
+def token_postings(index, token_id):
+    """(docs, positions) of every occurrence of token_id, in corpus order."""
+    return _lookup(index["unigram_keys"], index["unigram_offsets"], index["unigram_doc"], index["unigram_pos"],
+                   int(token_id))
+
+
+def bigram_postings(index, first, second):
+    """(docs, positions of first) for every adjacent (first, second) pair, in corpus order."""
+    if first >= index["vocab_size"] or second >= index["vocab_size"]:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    key = int(first) * index["vocab_size"] + int(second)
+    return _lookup(index["bigram_keys"], index["bigram_offsets"], index["bigram_doc"], index["bigram_pos"], key)
+
+
+def ngram_postings(index, ids, anchor=0):
+    """
+    (docs, positions) where the token sequence ids occurs; positions mark ids[anchor]
+    (default the first token, -1 for the last). Longer n-grams intersect the
+    bigram postings of consecutive pairs.
+    """
+    ids = [int(t) for t in ids]
+    if not ids:
+        raise ValueError("Empty n-gram")
+    anchor = anchor % len(ids)
+    if len(ids) == 1:
+        docs, positions = token_postings(index, ids[0])
+    else:
+        starts = _pack(*bigram_postings(index, ids[0], ids[1]))
+        for k in range(1, len(ids) - 1):
+            # Pair k starts k tokens after the n-gram start
+            docs, positions = bigram_postings(index, ids[k], ids[k + 1])
+            keep = positions >= k
+            docs, positions = docs[keep], positions[keep]
+            starts = np.intersect1d(starts, _pack(docs, positions - k), assume_unique=True)
+        docs, positions = _unpack(starts)
+    return docs, positions + anchor
+
+
+def documents_with(index, token_ids):
+    """Sorted ids of the documents containing any of token_ids."""
+    docs = [token_postings(index, t)[0] for t in token_ids]
+    return np.unique(np.concatenate(docs)) if docs else np.zeros(0, dtype=np.int64)
+
+
+def compound_targets(index, modifier, head):
+    """
+    Index-only counterpart of token_patterns.compound_masks: dict category -> list of
+    (doc_id, pos), sorted, with the same five categories and anchors. Only postings
+    of the modifier and head tokens are touched, never the rest of the corpus.
+    """
+    modifier = list(modifier)
+    head = list(head)
+    compound = modifier + head
+
+    modifier_hits = _pack(*ngram_postings(index, modifier, anchor=-1))
+    head_hits = _pack(*ngram_postings(index, head, anchor=-1))
+    in_compound = _pack(*ngram_postings(index, compound, anchor=len(modifier) - 1))
+    compound_head = _pack(*ngram_postings(index, compound, anchor=-1))
+    packed = {
+        "modifier": modifier_hits,
+        "modifier_in_compound": in_compound,
+        "modifier_alone": np.setdiff1d(modifier_hits, in_compound),
+        "compound_head": compound_head,
+        "other_head": np.setdiff1d(head_hits, compound_head),
+    }
+    targets = {}
+    for cat, hits in packed.items():
+        docs, positions = _unpack(np.sort(hits))
+        targets[cat] = list(zip(docs.tolist(), positions.tolist()))
+    return targets
+
+
+def index_dir(tokenizer_key, fingerprint, root=TOKEN_INDEX_DIR):
+    """Directory holding the index of one (tokenizer, corpus) pair."""
+    return os.path.join(root, f"{tokenizer_key[:16]}-{fingerprint[:16]}")
+
+
+def save_token_index(index, tokenizer_key, fingerprint, root=TOKEN_INDEX_DIR):
+    """Write the postings arrays as .npy files plus meta.json (see activation_store.atomic_save)."""
+    meta = {
+        "tokenizer_key": tokenizer_key,
+        "fingerprint": fingerprint,
+        "vocab_size": index["vocab_size"],
+        "n_documents": index["n_documents"],
+        "n_tokens": index["n_tokens"],
+    }
+    path = index_dir(tokenizer_key, fingerprint, root)
+    return atomic_save(path, {name: index[name] for name in INDEX_ARRAYS}, meta)
+
+
+def load_token_index(tokenizer_key, fingerprint, root=TOKEN_INDEX_DIR):
+    """Memory-mapped index, or None if it has not been built for this tokenizer and corpus."""
+    path = index_dir(tokenizer_key, fingerprint, root)
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+
+    index = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in INDEX_ARRAYS}
+    for key in ("vocab_size", "n_documents", "n_tokens"):
+        index[key] = meta[key]
+    return index
+
+
+def cached_token_index(model, texts, token_seqs_fn, prepend_bos=True, truncate=True, root=TOKEN_INDEX_DIR):
+    """
+    Load the index for (tokenizer, texts), or build it from token_seqs_fn() and save it.
+    token_seqs_fn is only called on a miss, so a stored index skips tokenization.
+    prepend_bos / truncate must describe how token_seqs_fn tokenizes.
+    """
+    tokenizer_key = tokenizer_fingerprint(model, prepend_bos, truncate)
+    fingerprint = dataset_fingerprint(texts)
+    index = load_token_index(tokenizer_key, fingerprint, root)
+    if index is not None:
+        print(f"Loaded token index from {index_dir(tokenizer_key, fingerprint, root)}")
+        return index
+    save_token_index(build_token_index(token_seqs_fn()), tokenizer_key, fingerprint, root)
+    return load_token_index(tokenizer_key, fingerprint, root)
@@ -0,0 +1,79 @@
+import torch
+
+# Wildcard entry for n-gram patterns: matches any (non-padding) token
+ANY = None
+
+
+def _token_hit(tokens, spec):
+    """Bool [batch, seq]: where tokens match one pattern entry (id, collection of ids, or ANY)."""
+    if spec is ANY:
+        return torch.ones_like(tokens, dtype=torch.bool)
+    if isinstance(spec, int):
+        return tokens == spec
+    return torch.isin(tokens, torch.as_tensor(list(spec), dtype=tokens.dtype, device=tokens.device))
+
+
+def _shift(x, offset):
+    """shifted[:, i] = x[:, i + offset], False where i + offset falls outside the sequence."""
+    if offset == 0:
+        return x
+    out = torch.zeros_like(x)
+    seq = x.shape[1]
+    if abs(offset) >= seq:
+        return out
+    if offset > 0:
+        out[:, :-offset] = x[:, offset:]
+    else:
+        out[:, -offset:] = x[:, :offset]
+    return out
+
+
+def match_ngram(tokens, pattern, anchor=-1, attention_mask=None):
+    """
+    Vectorized n-gram match over a [batch, seq] token tensor.
+
+    pattern: sequence of entries, each a token id, a collection of ids, or ANY.
+    anchor: which pattern element the returned mask marks (default: the last one,
+    e.g. the ' machine' position for [' washing', ' machine']).
+    Returns a bool mask [batch, seq]; padded positions (attention_mask == 0) never match.
+    """
+    n = len(pattern)
+    anchor = anchor % n
+    valid = torch.ones_like(tokens, dtype=torch.bool) if attention_mask is None else attention_mask.bool()
+    mask = valid.clone()
+    for k, spec in enumerate(pattern):
+        mask &= _shift(_token_hit(tokens, spec) & valid, k - anchor)
+    return mask
+
+
+def compound_masks(tokens, modifier, head, attention_mask=None):
+    """
+    Masks for a (possibly multi-token) compound modifier + head, e.g. [' washing'] + [' machine'].
+    Modifier categories mark the last modifier token, head categories the last head token.
+      modifier              every modifier occurrence
+      modifier_in_compound  modifier followed by head (' washing' in ' washing machine')
+      modifier_alone        modifier NOT followed by head (' washing the car')
+      compound_head         head preceded by modifier (' machine' in ' washing machine')
+      other_head            head NOT preceded by modifier (' time machine', ' machine')
+    """
+    modifier = list(modifier)
+    head = list(head)
+    compound = modifier + head
+
+    modifier_mask = match_ngram(tokens, modifier, attention_mask=attention_mask)
+    head_mask = match_ngram(tokens, head, attention_mask=attention_mask)
+    in_compound = match_ngram(tokens, compound, anchor=len(modifier) - 1, attention_mask=attention_mask)
+    compound_head = match_ngram(tokens, compound, anchor=-1, attention_mask=attention_mask)
+    return {
+        "modifier": modifier_mask,
+        "modifier_in_compound": in_compound,
+        "modifier_alone": modifier_mask & ~in_compound,
+        "compound_head": compound_head,
+        "other_head": head_mask & ~compound_head,
+    }
+
+
+def mask_to_indices(mask):
+    """(batch_idx, positions) LongTensors for the True entries of a [batch, seq] mask, row-major."""
+    idx = mask.nonzero()
+    return idx[:, 0], idx[:, 1]
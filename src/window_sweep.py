@@ -0,0 +1,59 @@
+import numpy as np
+
+from accumulators import cosine_sim
+from activation_extractor import context_windows, gather_sequence_residuals
+from compound_sweep import compound_metrics
+
+
+def window_sweep(model, token_seqs, category_targets, windows, hook_name="blocks.11.hook_resid_post",
+                 batch_size=32, max_tokens=None, keep_bos=True, overlap_slack=None):
+    """
+    How much left context do the metrics need?
+
+    category_targets: dict category -> list of (doc_id, pos) (e.g. token_index.compound_targets).
+    Every window size is compared against the largest window the model allows
+    (n_ctx - 1 tokens plus BOS, i.e. the full document when it fits). One row per
+    window with the tokens forwarded, compound_sweep.compound_metrics and, per category,
+    the cosine between windowed and reference means and the mean per-row cosine.
+    """
+    targets = sorted({t for ts in category_targets.values() for t in ts})
+    row_of = {t: r for r, t in enumerate(targets)}
+    rows_by_cat = {cat: [row_of[t] for t in ts] for cat, ts in category_targets.items()}
+
+    def run(window):
+        # Cut once: the same windows are forwarded and counted
+        window_seqs, window_targets = context_windows(
+            token_seqs, targets, window, keep_bos, overlap_slack, max_len=model.cfg.n_ctx
+        )
+        vectors = gather_sequence_residuals(
+            model, window_seqs, window_targets, [hook_name], batch_size=batch_size, max_tokens=max_tokens
+        )[:, 0].numpy()
+        return vectors, sum(len(seq) for seq in window_seqs)
+
+    reference_window = model.cfg.n_ctx - 1 - (overlap_slack or 0)
+    reference, reference_tokens = run(reference_window)
+    reference_means = {cat: reference[rows].mean(axis=0) for cat, rows in rows_by_cat.items() if rows}
+
+    results = []
+    # Windows at least as large as the reference would not fit, or add nothing
+    windows = sorted((w for w in windows if w < reference_window), reverse=True)
+    for window in [reference_window] + windows:
+        vectors, n_tokens = (reference, reference_tokens) if window == reference_window else run(window)
+        activations = {cat: vectors[rows] for cat, rows in rows_by_cat.items()}
+        # Per-row cosine between the windowed and reference activation of the same occurrence
+        row_cos = np.sum(vectors * reference, axis=1) / (
+            np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference, axis=1)
+        )
+        results.append({
+            "window": window,
+            "tokens_forwarded": int(n_tokens),
+            "tokens_ratio": n_tokens / reference_tokens if reference_tokens else None,
+            "metrics": compound_metrics(activations),
+            "mean_cosine_vs_reference": {
+                cat: cosine_sim(activations[cat].mean(axis=0), mean) for cat, mean in reference_means.items()
+            },
+            "row_cosine_vs_reference": {
+                cat: float(row_cos[rows].mean()) for cat, rows in rows_by_cat.items() if rows
+            },
+        })
+    return results